@@ -1,17 +1,376 @@
+import os
+import re
+import glob
+import json
+import hashlib
 import argparse
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 
+# every numeric column a client_stream.py result file may contain, cast to one type
+METRIC_COLUMNS = ['timestamp', 'total_interests_sent', 'total_data_recieved', 'total_num_timeouts',
+                  'total_num_nacks', 'packet_loss_percent', 'time_to_first_byte_ms', 'latency',
+                  'data_goodput_kilobytes', 'total_data_goodput_kilobytes', 'bitrate_kbps', 'average_latency',
+                  'rtt_p50_ms', 'rtt_p90_ms', 'rtt_p99_ms', 'rtt_max_ms', 'congestion_window',
+                  'total_retransmissions', 'total_first_try_data', 'total_retransmitted_data',
+                  'total_abandoned', 'rto_ms', 'window_interests_sent', 'window_interests_lost',
+                  'target_interest_rate', 'achieved_interest_rate']
+
+# the metrics summarized by default
+SUMMARY_METRICS = ['bitrate_kbps', 'latency', 'average_latency', 'packet_loss_percent']
+
+# result files are named data<client>-<prefix with dashes>, e.g. data3-ndn-external-test.csv
+RESULT_FILENAME = re.compile(r'^data-?(?P<client>.+?)-(?P<prefix>ndn-.+)\.(?P<format>csv|arrow|parquet)$')
+
+# parsed result files are cached as typed Parquet in this subdirectory of each experiment
+CACHE_DIRECTORY = '.analysis-cache'
+CACHE_MANIFEST = 'manifest.json'
+
+# cached files are only used if they were parsed into the same schema (bump the version
+# whenever cast_schema changes how files are parsed)
+CACHE_VERSION = 1
+CACHE_SCHEMA = hashlib.sha256(json.dumps([CACHE_VERSION, METRIC_COLUMNS]).encode()).hexdigest()
+
+# the metrics compared between two experiments, and the name used for each in reports
+COMPARISON_METRICS = {'bitrate_kbps': "bitrate (kbps)", 'latency': "latency (ms)",
+                      'packet_loss_percent': "packet loss (%)", 'time_to_first_byte_ms': "time to first byte (ms)"}
+
+# metrics that are measured once per client rather than in every row
+PER_CLIENT_METRICS = ['time_to_first_byte_ms']
+
+
+def parse_result_filename(path):
+    """Returns the client and prefix a result file belongs to, or None if it isn't a result file."""
+    match = RESULT_FILENAME.match(os.path.basename(path))
+    if match is None:
+        return None
+    return match.group('client'), '/' + match.group('prefix').replace('-', '/')
+
+
+def read_result_file(path):
+    """Reads a single result file in any of the formats client_stream.py writes."""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.arrow'):
+        import pyarrow
+        with open(path, 'rb') as f:
+            return pyarrow.ipc.open_stream(f).read_all().to_pandas()
+    return pd.read_csv(path)
+
+
+def cast_schema(data):
+    """Casts every metric column to float64, adding missing ones and turning placeholders like 'not implemented' into NaN."""
+    for column in METRIC_COLUMNS:
+        if column in data:
+            data[column] = pd.to_numeric(data[column], errors='coerce').astype('float64')
+        else:
+            data[column] = np.nan
+    return data
+
+
+def file_hash(path):
+    """Returns the SHA-256 hash of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExperimentCache():
+    """Typed columnar cache of the parsed result files of one experiment directory.
+
+    Each result file is parsed once into a Parquet file with the cast schema. A manifest
+    records the modification time, size and hash of every source file, so only files that
+    changed are parsed again. Files whose modification time changed but whose contents did
+    not are recognized by their hash and not parsed again. Files cached with a different
+    schema are always parsed again.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._cache_directory = os.path.join(directory, CACHE_DIRECTORY)
+        self._manifest_path = os.path.join(self._cache_directory, CACHE_MANIFEST)
+
+        # how many files were served from the cache and how many were parsed on the last load
+        self._num_hits = 0
+        self._num_ingested = 0
+
+        try:
+            with open(self._manifest_path) as f:
+                self._manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._manifest = {}
+
+
+    def get_num_hits(self):
+        return self._num_hits
+
+
+    def get_num_ingested(self):
+        return self._num_ingested
+
+
+    def load(self, path):
+        """Returns the parsed, typed contents of a result file, from the cache if it is up to date."""
+
+        name = os.path.basename(path)
+        cached_path = os.path.join(self._cache_directory, name + '.parquet')
+        status = os.stat(path)
+        entry = self._manifest.get(name)
+
+        if (entry is not None and entry.get('schema') == CACHE_SCHEMA and os.path.exists(cached_path)
+                and entry['size'] == status.st_size):
+            # unchanged modification time, or touched without changing contents
+            if entry['mtime'] == status.st_mtime_ns or entry['sha256'] == file_hash(path):
+                entry['mtime'] = status.st_mtime_ns
+                self._num_hits += 1
+                return pd.read_parquet(cached_path)
+
+        frame = cast_schema(read_result_file(path))
+        os.makedirs(self._cache_directory, exist_ok=True)
+        frame.to_parquet(cached_path, index=False)
+        self._manifest[name] = {'mtime': status.st_mtime_ns, 'size': status.st_size, 'sha256': file_hash(path),
+                                'schema': CACHE_SCHEMA}
+        self._num_ingested += 1
+        return frame
+
+
+    def save(self):
+        """Writes the manifest, dropping entries for source files that no longer exist."""
+
+        for name in list(self._manifest):
+            if not os.path.exists(os.path.join(self._directory, name)):
+                del self._manifest[name]
+                cached_path = os.path.join(self._cache_directory, name + '.parquet')
+                if os.path.exists(cached_path):
+                    os.remove(cached_path)
+
+        os.makedirs(self._cache_directory, exist_ok=True)
+        temporary_path = self._manifest_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(temporary_path, self._manifest_path)
+
+
+
+def load_experiment(directory, bin_width=0.5, use_cache=True):
+    """Loads every result file in an experiment directory into one dataframe.
+
+    Each row is tagged with its client and prefix, and with the timestamp bin it falls in
+    so that rows from different clients can be aligned. Parsed files are cached unless
+    use_cache is False.
+    """
+
+    cache = ExperimentCache(directory) if use_cache else None
+
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, 'data*'))):
+        source = parse_result_filename(path)
+        if source is None:
+            continue
+        frame = cache.load(path) if cache is not None else cast_schema(read_result_file(path))
+        frame['client'], frame['prefix'] = source
+        frames.append(frame)
+
+    if len(frames) == 0:
+        raise FileNotFoundError(f"No result files found in {directory}")
+
+    if cache is not None:
+        cache.save()
+
+    data = pd.concat(frames, ignore_index=True)
+    data['client'] = data['client'].astype('category')
+    data['prefix'] = data['prefix'].astype('category')
+
+    # align rows on the measurement window they belong to
+    data['time_bin'] = np.round(data['timestamp'] / bin_width) * bin_width
+    return data
+
+
+def summarize(data, by, metrics=SUMMARY_METRICS):
+    """Computes the mean, standard deviation, percentiles and a 95% confidence interval of each metric per group.
+
+    The confidence interval uses the normal approximation. Pass by=[] to summarize all rows together.
+    """
+
+    values = data[list(by) + metrics]
+    if len(by) == 0:
+        values = values.assign(_all='all')
+        by = ['_all']
+    grouped = values.groupby(by, observed=True)[metrics]
+
+    count = grouped.count()
+    mean = grouped.mean()
+    std = grouped.std()
+    half_width = 1.96 * std / np.sqrt(count)
+
+    statistics = {'count': count, 'mean': mean, 'std': std,
+                  'p50': grouped.quantile(0.5), 'p90': grouped.quantile(0.9), 'p99': grouped.quantile(0.99),
+                  'ci95_low': mean - half_width, 'ci95_high': mean + half_width}
+
+    # one column per (metric, statistic) pair
+    summary = pd.concat(statistics, axis=1).swaplevel(axis=1)
+    return summary[metrics]
+
+
+def aggregate(data, metrics=SUMMARY_METRICS):
+    """Returns per-prefix, per-client, whole-experiment and per-time-bin summaries of an experiment."""
+    return {'per_prefix': summarize(data, ['prefix'], metrics),
+            'per_client': summarize(data, ['prefix', 'client'], metrics),
+            'experiment': summarize(data, [], metrics),
+            'timeline': summarize(data, ['prefix', 'time_bin'], metrics)}
+
+
+def plot_timeline(timeline, metric='bitrate_kbps'):
+    """Plots the mean of a metric across clients over time for each prefix, with its confidence interval."""
+    for prefix, rows in timeline[metric].groupby(level='prefix', observed=True):
+        time_bins = rows.index.get_level_values('time_bin')
+        plt.plot(time_bins, rows['mean'], label=prefix)
+        plt.fill_between(time_bins, rows['ci95_low'], rows['ci95_high'], alpha=0.2)
+    plt.ylabel(metric)
+    plt.xlabel("time (s)")
+    plt.legend()
+
+
+def comparison_samples(data, metric):
+    """Returns the samples of a metric for each prefix, one per row or one per client for per-client metrics."""
+    values = data[['prefix', 'client', metric]].dropna()
+    if metric in PER_CLIENT_METRICS:
+        values = values.groupby(['prefix', 'client'], observed=True, as_index=False).first()
+    return {prefix: rows[metric].to_numpy() for prefix, rows in values.groupby('prefix', observed=True)}
+
+
+def bootstrap_difference(baseline, treatment, num_resamples=10000, confidence=0.95, rng=None):
+    """Returns the difference in means (treatment - baseline) and its bootstrap confidence interval."""
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    # resample both experiments independently, all resamples at once
+    baseline_means = rng.choice(baseline, (num_resamples, len(baseline))).mean(axis=1)
+    treatment_means = rng.choice(treatment, (num_resamples, len(treatment))).mean(axis=1)
+    differences = treatment_means - baseline_means
+
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(differences, [tail, 100 - tail])
+    return treatment.mean() - baseline.mean(), low, high
+
+
+def compare_experiments(baseline, treatment, num_resamples=10000, seed=0):
+    """Compares every metric of two loaded experiments per prefix.
+
+    Returns a table with the mean of each experiment, their difference (treatment - baseline)
+    with a bootstrap 95% confidence interval, and the relative change.
+    """
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for metric in COMPARISON_METRICS:
+        baseline_samples = comparison_samples(baseline, metric)
+        treatment_samples = comparison_samples(treatment, metric)
+        for prefix in sorted(set(baseline_samples) & set(treatment_samples)):
+            a, b = baseline_samples[prefix], treatment_samples[prefix]
+            if len(a) == 0 or len(b) == 0:
+                continue
+            difference, low, high = bootstrap_difference(a, b, num_resamples, rng=rng)
+            rows.append({'prefix': prefix, 'metric': metric,
+                         'baseline_mean': a.mean(), 'treatment_mean': b.mean(),
+                         'difference': difference, 'ci95_low': low, 'ci95_high': high,
+                         'relative_change_percent': difference / a.mean() * 100 if a.mean() != 0 else np.nan,
+                         'baseline_samples': len(a), 'treatment_samples': len(b)})
+
+    return pd.DataFrame(rows).set_index(['prefix', 'metric'])
+
+
+def write_comparison_report(baseline, treatment, comparison, output_directory, labels=("baseline", "treatment")):
+    """Saves the comparison table and one figure per metric, plus a bitrate timeline, to output_directory."""
+
+    os.makedirs(output_directory, exist_ok=True)
+    comparison.to_csv(os.path.join(output_directory, 'comparison.csv'))
+
+    for metric, description in COMPARISON_METRICS.items():
+        if metric not in comparison.index.get_level_values('metric'):
+            continue
+        rows = comparison.xs(metric, level='metric')
+        positions = np.arange(len(rows))
+
+        figure, (means, differences) = plt.subplots(1, 2, figsize=(10, 4))
+
+        means.bar(positions - 0.2, rows['baseline_mean'], 0.4, label=labels[0])
+        means.bar(positions + 0.2, rows['treatment_mean'], 0.4, label=labels[1])
+        means.set_xticks(positions, rows.index)
+        means.set_ylabel(description)
+        means.legend()
+
+        errors = [rows['difference'] - rows['ci95_low'], rows['ci95_high'] - rows['difference']]
+        differences.bar(positions, rows['difference'], 0.5, yerr=errors, capsize=4)
+        differences.axhline(0, color='black', linewidth=0.8)
+        differences.set_xticks(positions, rows.index)
+        differences.set_ylabel(f"{labels[1]} - {labels[0]}")
+
+        figure.tight_layout()
+        figure.savefig(os.path.join(output_directory, f"{metric}.png"))
+        plt.close(figure)
+
+    figure = plt.figure(figsize=(10, 4))
+    for label, data in zip(labels, (baseline, treatment)):
+        timeline = summarize(data, ['prefix', 'time_bin'], ['bitrate_kbps'])['bitrate_kbps']
+        for prefix, rows in timeline.groupby(level='prefix', observed=True):
+            plt.plot(rows.index.get_level_values('time_bin'), rows['mean'], label=f"{label} {prefix}")
+    plt.ylabel("bitrate (kbps)")
+    plt.xlabel("time (s)")
+    plt.legend()
+    figure.tight_layout()
+    figure.savefig(os.path.join(output_directory, 'bitrate_timeline.png'))
+    plt.close(figure)
+
+
 def main():
 
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--filename", help="the name of the file to analyze", default="data.csv")
+    parser.add_argument("--directory", help="an experiment directory to aggregate all result files from")
+    parser.add_argument("--bin", help="the width of the timestamp bins used to align clients (seconds)", type=float, default=0.5)
+    parser.add_argument("--plot", help="plot the bitrate timeline of an aggregated experiment", action="store_true")
+    parser.add_argument("--compare", help="compare two experiment directories (baseline first, e.g. no caching then caching)", nargs=2, metavar=("BASELINE", "TREATMENT"))
+    parser.add_argument("--labels", help="names of the two compared experiments", nargs=2, default=["baseline", "treatment"])
+    parser.add_argument("-o", "--output_directory", help="the directory comparison reports are written to", default="report")
+    parser.add_argument("--resamples", help="the number of bootstrap resamples for confidence intervals", type=int, default=10000)
+    parser.add_argument("--no_cache", help="parse every result file again instead of using the cached copies", action="store_true")
 
     args = parser.parse_args()
 
+    # compare two experiments, writing figures instead of showing them
+    if args.compare is not None:
+        plt.switch_backend('Agg')
+        baseline = load_experiment(args.compare[0], args.bin, not args.no_cache)
+        treatment = load_experiment(args.compare[1], args.bin, not args.no_cache)
+        comparison = compare_experiments(baseline, treatment, args.resamples)
+        write_comparison_report(baseline, treatment, comparison, args.output_directory, args.labels)
+
+        pd.set_option('display.width', 200)
+        print(comparison.to_string(float_format=lambda value: f"{value:.3f}"))
+        print(f"\nReport written to {args.output_directory}")
+        return
+
+    # aggregate a whole experiment
+    if args.directory is not None:
+        data = load_experiment(args.directory, args.bin, not args.no_cache)
+        summaries = aggregate(data)
+
+        pd.set_option('display.width', 200)
+        for name in ('experiment', 'per_prefix', 'per_client'):
+            print(f"\n{name}:")
+            print(summaries[name].T)
+
+        if args.plot:
+            plot_timeline(summaries['timeline'])
+            plt.show()
+        return
+
     data = pd.read_csv(args.filename)
 
     #  print(data)
@@ -0,0 +1,257 @@
+"""
+Batched UDP transport for the consumers, sending and recieving many packets per system call
+
+"""
+import ctypes
+import ctypes.util
+import errno
+import socket
+from pyndn.transport import UdpTransport
+from pyndn.util.common import Common
+
+
+# the number of packets handed to the kernel in one system call
+BATCH_SIZE = 64
+
+# the requested socket buffer sizes, so that bursts of packets aren't dropped between polls
+# (the kernel caps these at net.core.rmem_max and net.core.wmem_max)
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def _load_mmsg():
+    """Returns libc's sendmmsg and recvmmsg, or None where they aren't available."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return sendmmsg, recvmmsg
+
+
+_MMSG = _load_mmsg()
+
+
+
+class BatchedUdpTransport(UdpTransport):
+    """UDP transport that sends the packets queued during one event loop tick together, and drains
+    every waiting packet when polled.
+
+    Batches go out with sendmmsg and come in with recvmmsg where libc provides them, and with one
+    send or recv call per packet (but without polling the socket before each one) elsewhere.
+    """
+
+    def __init__(self, loop, batch_size=BATCH_SIZE):
+        super().__init__()
+        self._loop = loop
+        self._batch_size = batch_size
+        self._use_mmsg = _MMSG is not None
+
+        # packets waiting for the end of the current tick, and whether a flush is scheduled
+        self._pending = []
+        self._flush_scheduled = False
+        self._waiting_for_writable = False
+
+        # message headers pointing at the pending packets
+        self._send_iovecs = (_IoVec * batch_size)()
+        self._send_headers = (_MMsgHdr * batch_size)()
+        for i in range(0, batch_size):
+            self._send_headers[i].msg_hdr.msg_iov = ctypes.pointer(self._send_iovecs[i])
+            self._send_headers[i].msg_hdr.msg_iovlen = 1
+
+        # one maximum-size slot per packet recieved in a batch
+        self._slot_size = Common.MAX_NDN_PACKET_SIZE
+        self._recieve_arena = bytearray(self._slot_size * batch_size)
+        self._recieve_view = memoryview(self._recieve_arena)
+        arena_address = ctypes.addressof(ctypes.c_char.from_buffer(self._recieve_arena))
+        self._recieve_iovecs = (_IoVec * batch_size)()
+        self._recieve_headers = (_MMsgHdr * batch_size)()
+        for i in range(0, batch_size):
+            self._recieve_iovecs[i].iov_base = arena_address + i * self._slot_size
+            self._recieve_iovecs[i].iov_len = self._slot_size
+            self._recieve_headers[i].msg_hdr.msg_iov = ctypes.pointer(self._recieve_iovecs[i])
+            self._recieve_headers[i].msg_hdr.msg_iovlen = 1
+
+        # keep track of how well packets are batched
+        self._num_packets_sent = 0
+        self._num_send_calls = 0
+        self._num_packets_recieved = 0
+        self._num_recieve_calls = 0
+
+
+    def connect(self, connectionInfo, elementListener, onConnected):
+        """Connects the socket to the forwarder, without blocking and with enlarged buffers."""
+
+        super().connect(connectionInfo, elementListener, None)
+
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        # a connected socket needs no address per packet and only recieves from the forwarder
+        self._socket.connect(self._address)
+        self._socket.setblocking(False)
+
+        if onConnected is not None:
+            onConnected()
+
+
+    def send(self, data):
+        """Queues a packet to be sent with the others queued during this event loop tick."""
+
+        self._pending.append(bytes(data))
+        if not self._flush_scheduled and not self._waiting_for_writable:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+
+    def _flush(self):
+        """Sends as many pending packets as the socket takes, waiting for it to drain if it is full."""
+
+        self._flush_scheduled = False
+        if self._socket is None:
+            self._pending = []
+            return
+
+        while len(self._pending) > 0:
+            sent = self._send_batch(self._pending[:self._batch_size])
+            if sent == 0:
+                break
+            del self._pending[:sent]
+
+        # resume once the socket is writable again
+        if len(self._pending) > 0 and not self._waiting_for_writable:
+            self._waiting_for_writable = True
+            self._loop.add_writer(self._socket.fileno(), self._on_writable)
+
+
+    def _on_writable(self):
+        self._loop.remove_writer(self._socket.fileno())
+        self._waiting_for_writable = False
+        self._flush()
+
+
+    def _send_batch(self, packets):
+        """Sends packets from the front of a batch, returning how many the socket accepted."""
+
+        self._num_send_calls += 1
+
+        if not self._use_mmsg:
+            sent = 0
+            while sent < len(packets):
+                try:
+                    self._socket.send(packets[sent])
+                except BlockingIOError:
+                    break
+                except ConnectionRefusedError:
+                    # an earlier packet was refused, so try this one again
+                    continue
+                sent += 1
+            self._num_packets_sent += sent
+            return sent
+
+        for i, packet in enumerate(packets):
+            self._send_iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(packet), ctypes.c_void_p).value
+            self._send_iovecs[i].iov_len = len(packet)
+
+        while True:
+            sent = _MMSG[0](self._socket.fileno(), self._send_headers, len(packets), 0)
+            if sent >= 0:
+                self._num_packets_sent += sent
+                return sent
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            # retry after interruptions and errors left over from earlier packets
+            if error not in (errno.EINTR, errno.ECONNREFUSED):
+                raise OSError(error, f"sendmmsg failed: {errno.errorcode.get(error, error)}")
+
+
+    def processEvents(self):
+        """Recieves every packet waiting on the socket, passing each complete element on."""
+
+        if not self.getIsConnected():
+            return
+
+        # send anything still queued before waiting on replies
+        if self._flush_scheduled:
+            self._flush()
+
+        while True:
+            lengths = self._recieve_batch()
+            for i, length in enumerate(lengths):
+                start = i * self._slot_size
+                self._elementReader.onReceivedData(self._recieve_view[start:start + length])
+            if len(lengths) < self._batch_size:
+                return
+
+
+    def _recieve_batch(self):
+        """Returns the lengths of the packets recieved into the slots of the recieve arena."""
+
+        self._num_recieve_calls += 1
+
+        if not self._use_mmsg:
+            lengths = []
+            while len(lengths) < self._batch_size:
+                start = len(lengths) * self._slot_size
+                try:
+                    length = self._socket.recv_into(self._recieve_view[start:start + self._slot_size])
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+                lengths.append(length)
+            self._num_packets_recieved += len(lengths)
+            return lengths
+
+        while True:
+            count = _MMSG[1](self._socket.fileno(), self._recieve_headers, self._batch_size, socket.MSG_DONTWAIT, None)
+            if count >= 0:
+                self._num_packets_recieved += count
+                return [self._recieve_headers[i].msg_len for i in range(0, count)]
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            if error not in (errno.EINTR, errno.ECONNREFUSED):
+                raise OSError(error, f"recvmmsg failed: {errno.errorcode.get(error, error)}")
+
+
+    def close(self):
+        if self._waiting_for_writable and self._socket is not None:
+            self._loop.remove_writer(self._socket.fileno())
+            self._waiting_for_writable = False
+        self._pending = []
+        super().close()
+
+
+    def uses_mmsg(self):
+        return self._use_mmsg
+
+
+    def get_batch_sizes(self):
+        """Returns the average number of packets per send call and per recieve call."""
+        send = self._num_packets_sent / self._num_send_calls if self._num_send_calls != 0 else 0
+        recieve = self._num_packets_recieved / self._num_recieve_calls if self._num_recieve_calls != 0 else 0
+        return send, recieve
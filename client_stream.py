@@ -1,13 +1,19 @@
+import os
+import re
 import time
 import argparse
 import asyncio
+from collections import deque
 from pyndn import Name
 from pyndn import Interest
 from pyndn.transport import UdpTransport
 from pyndn.threadsafe_face import ThreadsafeFace
+from batched_transport import BatchedUdpTransport
 from pyndn import Face
+from congestion import create_window, CONGESTION_CONTROLS, TokenBucket
+from latency import LatencyHistogram, OutstandingTable, RttEstimator, LossTracker
+from metrics import MetricsBuffer, create_writer, OUTPUT_FORMATS
 import numpy as np
-import pandas as pd
 
 
 def dump(*list):
@@ -19,10 +25,56 @@ def dump(*list):
     print(result)
 
 
+# the columns of each metrics row and their types
+METRIC_COLUMNS = [('timestamp', 'f8'),
+                  ('total_interests_sent', 'i8'),
+                  ('total_data_recieved', 'i8'),
+                  ('total_num_timeouts', 'i8'),
+                  ('total_num_nacks', 'i8'),
+                  ('packet_loss_percent', 'f8'),
+                  ('time_to_first_byte_ms', 'f8'),
+                  ('latency', 'f8'),
+                  ('data_goodput_kilobytes', 'f8'),
+                  ('total_data_goodput_kilobytes', 'f8'),
+                  ('bitrate_kbps', 'f8'),
+                  ('average_latency', 'f8'),
+                  ('rtt_p50_ms', 'f8'),
+                  ('rtt_p90_ms', 'f8'),
+                  ('rtt_p99_ms', 'f8'),
+                  ('rtt_max_ms', 'f8'),
+                  ('congestion_window', 'f8'),
+                  ('total_retransmissions', 'i8'),
+                  ('total_first_try_data', 'i8'),
+                  ('total_retransmitted_data', 'i8'),
+                  ('total_abandoned', 'i8'),
+                  ('rto_ms', 'f8'),
+                  ('window_interests_sent', 'i8'),
+                  ('window_interests_lost', 'i8'),
+                  ('target_interest_rate', 'f8'),
+                  ('achieved_interest_rate', 'f8')]
+
+# the columns of each stage of a capacity sweep and their types
+SWEEP_COLUMNS = [('stage', 'i8'),
+                 ('target', 'f8'),
+                 ('throughput_kbps', 'f8'),
+                 ('achieved_interest_rate', 'f8'),
+                 ('rtt_p50_ms', 'f8'),
+                 ('rtt_p99_ms', 'f8'),
+                 ('loss_percent', 'f8'),
+                 ('power', 'f8')]
+
+# the settings a capacity sweep can step through
+SWEEP_MODES = ['rate', 'window']
+
+# the prefix of the interest that connects a face ahead of a synchronized start
+WARMUP_PREFIX = "/ndn/powder/warmup"
+
+
 class Consumer():
     """Creates a consumer for sending interest packets."""
 
-    def __init__(self, ip, verbose=0):
+    def __init__(self, ip, verbose=0, window=None, congestion_control='aimd', max_retries=None, lifetime=None, max_outstanding=65536,
+                 rate=None, data_size=1000, batch_udp=False, shards=1, face=None):
 
         # constants for adjusting performance
         self.UPDATE_TIMING = 0.001
@@ -36,13 +88,17 @@ class Consumer():
         self._time_to_run = 0
         # control verbosity
         self._verbose = verbose
-        # establish a local or remote face
-        self._face = self._setup_face(ip)
+        # establish a local or remote face, unless one is shared with other consumers
+        self._face = setup_face(self._loop, ip, batch_udp) if face is None else face
         # a prefix variable
         self._prefix = ""
+        # the number of producer workers the prefix is sharded across (see server_stream.py --workers)
+        self._shards = shards
 
-        # create a list of dictionaries for storing data from this stream
-        self._data = []
+        # fixed-size buffer of metrics rows from this stream (created when run)
+        self._data = None
+        # every task this consumer schedules, cancelled when it finishes
+        self._tasks = []
 
         # keep track of some performance metrics
         self._interests_sent = {'current': 0, 'previous': 0}
@@ -50,31 +106,83 @@ class Consumer():
         self._num_nacks = {'current': 0, 'previous': 0}
         self._num_timeouts = {'current': 0, 'previous': 0}
         self._time = {'current': 0, 'previous': 0, 'start': 0}
-        self._time_to_first_byte = 0
+        self._time_to_first_byte = None
         # keeps track of the whether the first data packet has been recieved
         self._is_first_packet = True
         self._send_latency_packet = False
         self._latency = {'interest': 0, 'data': 0}
         self._latency_packet = ""
         self._data_goodput = {'current': 0, 'previous': 0}
+        # send time of every outstanding interest, and the round trip times measured in the current window
+        self._outstanding = OutstandingTable(max_outstanding)
+        self._rtt = LatencyHistogram()
+        # interest lifetime in milliseconds (None uses the library default)
+        self._lifetime = lifetime
+
+        # loss of the interests sent in each measurement window, known only once they time out
+        self._losses = LossTracker(max_outstanding)
+        self._window_index = 0
+        # rows waiting for the outcome of every interest sent in their window
+        self._pending_rows = deque()
+
+        # retransmit lost interests up to max_retries times (None disables retransmission)
+        self._max_retries = max_retries
+        self._rto = RttEstimator()
+        # number of retransmissions of each outstanding sequence number that has been retransmitted
+        self._retries = {}
+        # timeouts of interests sent before this sequence number don't back off the timer again
+        self._backoff_point = 0
+        self._num_retransmissions = 0
+        self._first_try_data = 0
+        self._retransmitted_data = 0
+        self._num_abandoned = 0
+
+        # pace interests with a token bucket if a (value, unit) target rate is given, where the unit
+        # is interests or megabits of data per second (data_size is the expected data packet size)
+        self._rate = rate
+        self._data_size = data_size
+        self._pacer = None
+        if rate is not None:
+            value, unit = rate
+            self._pacer = TokenBucket(value * 1000000 if unit == 'mbps' else value)
+
+        # congestion window for pipelined fetching (None sends at a fixed rate instead)
+        self._window = None if window is None else create_window(congestion_control, window)
+        self._in_flight = 0
+        self._next_seq = 0
+        # set whenever an interest completes, so the sender can refill the window or outstanding table
+        self._window_event = asyncio.Event()
 
 
         print(f"Consumer instance created with UDP tunnel to {ip}!")
 
 
-    def _setup_face(self, ip):
-        """Sets up a face that connects to a remote forwarder."""
-        udp_connection_info = UdpTransport.ConnectionInfo(ip, 6363)
-        udp_transport = UdpTransport()
-        return ThreadsafeFace(self._loop, udp_transport, udp_connection_info)
-
-
-    def run(self, prefix, time_to_run):
+    def run(self, prefix, time_to_run, writer=None):
         """Runs this consumer, sending interests to the specified prefix.
 
-        Returns a dataframe containing performance information for analysis.
+        Returns a MetricsBuffer containing performance information for analysis. If a
+        writer is given, rows are also streamed to it as they are produced.
         """
 
+        self.start(prefix, time_to_run, writer)
+
+        # update face to recieve packets
+        self._tasks.append(self._loop.create_task(self._update()))
+        # schedule shutdown
+        self._tasks.append(self._loop.create_task(self._shutdown()))
+
+        # start event loop and run shutdown method activates
+        self._loop.run_forever()
+
+        # shutdown face to forwarder
+        self._face.shutdown()
+
+        return self.finish()
+
+
+    def start(self, prefix, time_to_run, writer=None):
+        """Schedules this consumer's stream on its event loop, without running the loop."""
+
         print(f"Starting stream for {time_to_run} seconds to {prefix}...")
 
         # properly name interests
@@ -84,24 +192,104 @@ class Consumer():
             self._prefix = prefix
 
         self._time_to_run = time_to_run
+        self._data = MetricsBuffer(METRIC_COLUMNS, writer=writer)
 
-        # update face to recieve packets
-        self._loop.create_task(self._update())
         # calculate and store performance information
-        self._loop.create_task(self._compute_metrics(0.5))
+        self._metrics_task = self._loop.create_task(self._compute_metrics(0.5))
         # send interest stream
-        self._loop.create_task(self._send_interests(self._prefix, time_to_run))
-        # schedule shutdown
-        self._loop.create_task(self._shutdown())
+        self._send_task = self._loop.create_task(self._send_interests(self._prefix, time_to_run))
+        self._tasks.extend([self._metrics_task, self._send_task])
 
-        # start event loop and run shutdown method activates
-        self._loop.run_forever()
 
-        # shutdown face to forwarder
-        self._face.shutdown()
+    def connect(self):
+        """Connects this consumer's face to its forwarder ahead of a synchronized start."""
+        connect_face(self._loop, self._face)
+
+
+    def stop(self):
+        """Stops sending interests and computing metrics before the stream's time is up."""
+        for task in self._tasks:
+            task.cancel()
+
+
+    async def sweep(self, mode, start, step, dwell, max_stages=20, loss_threshold=5.0, rtt_inflation=2.0, writer=None):
+        """Steps the send rate (interests per second) or fixed window size upward in stages.
+
+        Each stage runs for dwell seconds and is summarized from the metrics windows that fall
+        entirely inside it, once their loss is known. The sweep stops after the first stage whose
+        loss percentage exceeds loss_threshold or whose median round trip time exceeds rtt_inflation
+        times that of the first stage. Returns a MetricsBuffer with one row per stage, which
+        is also streamed to writer if one is given.
+        """
+
+        stages = MetricsBuffer(SWEEP_COLUMNS, capacity=max_stages, writer=writer)
+        base_rtt = None
+
+        for stage in range(max_stages):
+            target = start + stage * step
+            if mode == 'rate':
+                self._pacer.set_rate(target)
+            else:
+                self._window.set_window(target)
+                self._window_event.set()
+
+            stage_start = time.time() - self._time['start']
+            await asyncio.sleep(dwell)
+            stage_end = time.time() - self._time['start']
+
+            # keep sending at this stage's setting until its rows have been logged
+            last_window = self._window_index
+            while len(self._pending_rows) != 0 and self._pending_rows[0][0] < last_window:
+                await asyncio.sleep(0.1)
+
+            # summarize the windows entirely inside this stage
+            rows = self._data.rows()
+            rows = rows[(rows['timestamp'] - 0.5 >= stage_start) & (rows['timestamp'] <= stage_end)]
+            if len(rows) == 0:
+                raise ValueError(f"Dwell time of {dwell} seconds is too short to measure a stage")
+
+            with_data = rows[rows['rtt_p50_ms'] > 0]
+            rtt_p50 = float(np.median(with_data['rtt_p50_ms'])) if len(with_data) != 0 else float('nan')
+            rtt_p99 = float(np.mean(with_data['rtt_p99_ms'])) if len(with_data) != 0 else float('nan')
+            sent = rows['window_interests_sent'].sum()
+            loss = rows['window_interests_lost'].sum() / sent * 100 if sent != 0 else 0
+            throughput = float(np.mean(rows['bitrate_kbps']))
+
+            stages.append({'stage': stage,
+                           'target': target,
+                           'throughput_kbps': throughput,
+                           'achieved_interest_rate': float(np.mean(rows['achieved_interest_rate'])),
+                           'rtt_p50_ms': rtt_p50,
+                           'rtt_p99_ms': rtt_p99,
+                           'loss_percent': loss,
+                           # throughput over delay peaks at the knee of the curve
+                           'power': throughput / rtt_p50 if rtt_p50 > 0 else 0})
+
+            if self._verbose >= 1:
+                dump(f"Stage {stage} ({mode} {target}):", f"{throughput:.1f} kbps,", f"p50 rtt {rtt_p50:.3f} ms,", f"{loss:.2f}% loss")
+
+            # stop once the path is saturated (the base rtt comes from the first stage that measured one)
+            if base_rtt is None and not np.isnan(rtt_p50):
+                base_rtt = rtt_p50
+            if loss > loss_threshold or (base_rtt is not None and rtt_p50 > rtt_inflation * base_rtt):
+                break
+
+        return stages
+
+
+    def finish(self):
+        """Stops this consumer's tasks, writes out any remaining rows and returns this consumer's metrics.
+
+        Must be called while the event loop isn't running, so that the cancelled tasks can finish
+        before the loop is reused by another consumer.
+        """
+        self.stop()
+        self._loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+        self._tasks = []
 
-        # create dataframe from list of dictionaries
-        return pd.DataFrame(self._data)
+        self._append_resolved_rows(force=True)
+        self._data.close()
+        return self._data
 
 
     async def _send_interests(self, prefix, send_time):
@@ -110,25 +298,141 @@ class Consumer():
         # begin timing
         self._time['current'] = self._time['start'] = time.time()
 
+        if self._window is not None:
+            await self._send_pipelined(prefix, send_time)
+            return
+
+        if self._pacer is not None:
+            self._pacer.reset()
+
         # send interests for a specified amount of time
         i = 0
         while time.time() - self._time['start'] < send_time:
-            if self._send_latency_packet:
-                self._latency_packet = prefix + str(i)
-                self._latency['interest'] = time.time()
-                self._send_latency_packet = False
-            self._send(prefix + str(i))
-            i += 1
+
+            # send a batch of however many interests the pacer allows since the last wakeup
+            num_to_send = 1
+            if self._pacer is not None:
+                cost = self._get_send_cost()
+                num_to_send = self._pacer.take(cost)
+                if num_to_send == 0:
+                    await asyncio.sleep(self._pacer.get_delay(cost))
+                    continue
+
+            for j in range(num_to_send):
+                # block while the outstanding table is full
+                if not await self._wait_for_slot(i, send_time - (time.time() - self._time['start'])):
+                    return
+                if self._send_latency_packet:
+                    self._latency_packet = self._get_name(prefix, i)
+                    self._latency['interest'] = time.time()
+                    self._send_latency_packet = False
+                self._send(self._get_name(prefix, i), i)
+                i += 1
+
             # interest sending rate
-            await asyncio.sleep(self.SEND_RATE)
+            await asyncio.sleep(self.SEND_RATE if self._pacer is None else 0)
+
+
+    def _get_send_cost(self):
+        """Returns the tokens an interest costs: 1, or the expected size of its data packet in bits when pacing by bitrate."""
+
+        if self._rate[1] != 'mbps':
+            return 1
+        if self._data_recieved['current'] != 0:
+            return self._data_goodput['current'] / self._data_recieved['current'] * 8
+        return self._data_size * 8
+
+
+    def get_target_interest_rate(self):
+        """Returns the interest rate the pacer is aiming for (NaN if not paced)."""
+        if self._pacer is None:
+            return float('nan')
+        return self._pacer.get_rate() / self._get_send_cost()
+
+
+    async def _send_pipelined(self, prefix, send_time):
+        """Keeps up to a congestion window of interests outstanding for a specified amount of time."""
+
+        while True:
+            remaining = send_time - (time.time() - self._time['start'])
+            if remaining <= 0:
+                break
+
+            # fill the window, as far as the outstanding table allows
+            while self._in_flight < int(self._window.get_window()) and self._outstanding.can_add(self._next_seq):
+                if self._send_latency_packet:
+                    self._latency_packet = self._get_name(prefix, self._next_seq)
+                    self._latency['interest'] = time.time()
+                    self._send_latency_packet = False
+                self._send(self._get_name(prefix, self._next_seq), self._next_seq)
+
+            # wait for an interest to complete
+            self._window_event.clear()
+            try:
+                await asyncio.wait_for(self._window_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
 
+    async def _wait_for_slot(self, seq, timeout):
+        """Waits until seq fits in the outstanding table. Returns False if the timeout (seconds) passes first."""
 
-    def _send(self, name):
+        while not self._outstanding.can_add(seq):
+            self._window_event.clear()
+            try:
+                await asyncio.wait_for(self._window_event.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+    def _release(self, seq):
+        """Frees an interest's slot in the outstanding table once it is satisfied or given up on."""
+        self._outstanding.remove(seq)
+        self._window_event.set()
+
+
+    def _on_interest_done(self, interest, is_lost):
+        """Updates the congestion window when an interest is satisfied or lost."""
+
+        if self._window is None:
+            return
+
+        self._in_flight -= 1
+        if is_lost:
+            self._window.on_loss(self._get_seq(interest), self._next_seq)
+        else:
+            self._window.on_data()
+        self._window_event.set()
+
+
+    def _get_name(self, prefix, seq):
+        """Returns the name of the interest for a sequence number, under its shard's component if the producer is sharded."""
+        if self._shards > 1:
+            return prefix + str(seq % self._shards) + "/" + str(seq)
+        return prefix + str(seq)
+
+
+    def _get_seq(self, interest):
+        """Returns the sequence number of an interest sent by this consumer."""
+        return int(interest.getName().get(-1).toEscapedString())
+
+
+    def _send(self, name, seq):
         """Sends a singular interest."""
         interest = Interest(name)
         interest.setMustBeFresh(False)
+        if self._max_retries is not None:
+            interest.setInterestLifetimeMilliseconds(self._rto.get_rto())
+        elif self._lifetime is not None:
+            interest.setInterestLifetimeMilliseconds(self._lifetime)
+        self._outstanding.add(seq, time.time())
+        self._losses.on_send(seq, self._window_index)
+        if seq >= self._next_seq:
+            self._next_seq = seq + 1
         self._face.expressInterest(interest, self.onData, self.onTimeout, self.onNetworkNack)
         self._interests_sent['current'] += 1
+        self._in_flight += 1
 
         if self._verbose >= 2:
             dump("Send interest with name", name)
@@ -141,9 +445,25 @@ class Consumer():
             self._time_to_first_byte = time.time()
             self._is_first_packet = False
 
+        seq = self._get_seq(interest)
+        self._losses.on_outcome(seq, False)
+
         if self._latency_packet == data.getName().toUri():
             self._latency['data'] = time.time()
 
+        # record the round trip time of this interest, skipping ambiguous retransmitted samples
+        if seq in self._retries:
+            del self._retries[seq]
+            self._retransmitted_data += 1
+        else:
+            self._first_try_data += 1
+            send_time = self._outstanding.get_send_time(seq)
+            if send_time is not None:
+                rtt = (time.time() - send_time) * 1000
+                self._rtt.record(rtt)
+                self._rto.add_measurement(rtt)
+        self._release(seq)
+
         self._data_recieved['current'] += 1
 
         if self._verbose >= 2:
@@ -153,20 +473,56 @@ class Consumer():
         # add the data packet size to total goodput
         self._data_goodput['current'] += len(data.getContent())
 
+        self._on_interest_done(interest, False)
+
 
     def onTimeout(self, interest):
         """Called when an interest packet times out."""
         self._num_timeouts['current'] += 1
+        self._losses.on_outcome(self._get_seq(interest), True)
         if self._verbose >= 2:
             dump("Time out for interest", interest.getName().toUri())
 
+        self._on_interest_done(interest, True)
+
+        # back off the retransmission timer (once per round of interests) before trying again
+        if self._max_retries is not None and self._get_seq(interest) >= self._backoff_point:
+            self._rto.backoff()
+            self._backoff_point = self._next_seq
+        self._retransmit(interest)
+
 
     def onNetworkNack(self, interest, networkNack):
         """Called when an interest packet is responded to with a nack."""
         self._num_nacks['current'] += 1
+        self._losses.on_outcome(self._get_seq(interest), True)
         if self._verbose >= 2:
             dump("Network nack for interest", interest.getName().toUri())
 
+        self._on_interest_done(interest, True)
+        self._retransmit(interest)
+
+
+    def _retransmit(self, interest):
+        """Sends a lost interest again if reliable mode is on and it has retries left."""
+
+        seq = self._get_seq(interest)
+        if self._max_retries is None:
+            self._release(seq)
+            return
+
+        retries = self._retries.get(seq, 0)
+        if retries >= self._max_retries:
+            # give up, leaving a hole in the stream
+            self._retries.pop(seq, None)
+            self._num_abandoned += 1
+            self._release(seq)
+            return
+
+        self._retries[seq] = retries + 1
+        self._num_retransmissions += 1
+        self._send(interest.getName(), seq)
+
 
     async def _compute_metrics(self, measurement_rate):
         """Returns a dictionary containing performance information.
@@ -182,6 +538,7 @@ class Consumer():
             self._num_nacks['previous'] = self._num_nacks['current']
             self._num_timeouts['previous'] = self._num_timeouts['current']
             self._interests_sent['previous'] = self._interests_sent['current']
+            self._rtt.reset()
 
             # arrange for latency measurement
             self._send_latency_packet = True
@@ -198,24 +555,17 @@ class Consumer():
             # calculate kbps
             download_kbps = (data_goodput_kilobytes * 8) / (self._time['current'] - self._time['previous'])
 
-            # calculate time to first byte (milliseconds)
-            try:
-                time_to_first_byte_ms = (self._time_to_first_byte - self._time['start']) * 1000
-            except:
-                print("Time to first byte could not be calculated.")
-                time_to_first_byte_ms = "not computed"
-
-            # calculate packet loss (as a percentage)
-            dropped_packets = (self._num_timeouts['current'] - self._num_timeouts['previous']) + (self._num_nacks['current'] - self._num_nacks['previous'])
-            requested_packets = self._interests_sent['current'] - self._interests_sent['previous']
+            # calculate the interest rate actually achieved in this window
+            achieved_interest_rate = (self._interests_sent['current'] - self._interests_sent['previous']) / (self._time['current'] - self._time['previous'])
 
-            if requested_packets != 0:
-                packet_loss = (dropped_packets / requested_packets) * 100
+            # calculate time to first byte (milliseconds), unknown until the first data packet arrives
+            if self._time_to_first_byte is not None:
+                time_to_first_byte_ms = (self._time_to_first_byte - self._time['start']) * 1000
             else:
-                packet_loss = 0
+                time_to_first_byte_ms = float('nan')
 
-            # calculate average latency
-            average_latency = 'not implemented' # TODO
+            # summarize round trip times of data recieved in this window (milliseconds)
+            rtt = self._rtt.summary()
 
             if download_kbps == 0:
                 latency = 0
@@ -229,20 +579,57 @@ class Consumer():
                     'total_data_recieved': self._data_recieved['current'],
                     'total_num_timeouts': self._num_timeouts['current'],
                     'total_num_nacks': self._num_nacks['current'],
-                    'packet_loss_percent': packet_loss,
+                    'packet_loss_percent': 0,
                     'time_to_first_byte_ms': time_to_first_byte_ms,
                     'latency': latency,
                     'data_goodput_kilobytes': data_goodput_kilobytes,
                     'total_data_goodput_kilobytes': self._data_goodput['current'] / 1000,
                     'bitrate_kbps': download_kbps,
-                    'average_latency': average_latency
+                    'average_latency': rtt['mean'],
+                    'rtt_p50_ms': rtt['p50'],
+                    'rtt_p90_ms': rtt['p90'],
+                    'rtt_p99_ms': rtt['p99'],
+                    'rtt_max_ms': rtt['max'],
+                    'congestion_window': 0 if self._window is None else self._window.get_window(),
+                    'total_retransmissions': self._num_retransmissions,
+                    'total_first_try_data': self._first_try_data,
+                    'total_retransmitted_data': self._retransmitted_data,
+                    'total_abandoned': self._num_abandoned,
+                    'rto_ms': self._rto.get_rto(),
+                    'target_interest_rate': self.get_target_interest_rate(),
+                    'achieved_interest_rate': achieved_interest_rate
                     }
 
+            # packet loss is filled in once every interest sent in this window has an outcome
+            self._pending_rows.append((self._window_index, data))
+            self._window_index += 1
 
             # add data to log
-            self._data.append(data)
+            self._append_resolved_rows()
 
 
+    def _append_resolved_rows(self, force=False):
+        """Logs waiting rows, in order, whose window's loss is known (or all of them if force is set).
+
+        Packet loss is attributed to the window each interest was first sent in, so a row is only
+        logged once its interests have been satisfied or timed out. When forced, interests still
+        without an outcome count as lost.
+        """
+
+        while len(self._pending_rows) != 0:
+            window, data = self._pending_rows[0]
+            if not force and not self._losses.is_resolved(window):
+                break
+            self._pending_rows.popleft()
+
+            # calculate packet loss (as a percentage)
+            sent, lost = self._losses.get_loss(window)
+            data['window_interests_sent'] = sent
+            data['window_interests_lost'] = lost
+            data['packet_loss_percent'] = (lost / sent) * 100 if sent != 0 else 0
+
+            self._data.append(data)
+
 
     async def _update(self):
         """Updates events on this Consumer's face."""
@@ -265,13 +652,121 @@ class Consumer():
 
 
 
+def setup_face(loop, ip, batch_udp=False):
+    """Sets up a face that connects to a remote forwarder, optionally batching packets per event loop tick."""
+    udp_connection_info = UdpTransport.ConnectionInfo(ip, 6363)
+    udp_transport = BatchedUdpTransport(loop) if batch_udp else UdpTransport()
+    return ThreadsafeFace(loop, udp_transport, udp_connection_info)
+
+
+def connect_face(loop, face):
+    """Connects a face to its forwarder now rather than when its first interest is sent.
+
+    Faces connect lazily, so a short-lived warm-up interest is expressed and the event loop
+    run just long enough to send it.
+    """
+    interest = Interest(Name(WARMUP_PREFIX).append(str(time.time())))
+    interest.setCanBePrefix(False)
+    interest.setInterestLifetimeMilliseconds(100)
+    face.expressInterest(interest, lambda interest, data: None, lambda interest: None, lambda interest, networkNack: None)
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+
+def wait_until(start_time):
+    """Blocks until the given wall-clock time (in seconds since the epoch)."""
+
+    remaining = start_time - time.time()
+    if remaining < 0:
+        print(f"Start time passed {-remaining:.3f} seconds ago, starting now.")
+        return
+
+    print(f"Waiting {remaining:.3f} seconds for synchronized start...")
+
+    # sleep most of the way, then spin for an accurate start
+    if remaining > 0.05:
+        time.sleep(remaining - 0.05)
+    while time.time() < start_time:
+        pass
+
+
+def run_concurrently(ip, prefixes, time_to_run, writers, start_time=None, **consumer_options):
+    """Streams to several prefixes at once over one face and event loop.
+
+    If start_time is given, streaming begins at that wall-clock time.
+    Returns a list of MetricsBuffers, one per prefix.
+    """
+
+    loop = asyncio.get_event_loop()
+    face = setup_face(loop, ip, consumer_options.get('batch_udp', False))
+    consumers = [Consumer(ip, face=face, **consumer_options) for prefix in prefixes]
+
+    if start_time is not None:
+        connect_face(loop, face)
+        wait_until(start_time)
+
+    for consumer, prefix, writer in zip(consumers, prefixes, writers):
+        consumer.start(prefix, time_to_run, writer)
+
+    # a single task updates the shared face for every consumer
+    update_task = loop.create_task(consumers[0]._update())
+
+    # wait an extra 5 seconds to allow any unrecieved interests to timeout
+    loop.run_until_complete(asyncio.sleep(time_to_run + 5))
+
+    update_task.cancel()
+    loop.run_until_complete(asyncio.gather(update_task, return_exceptions=True))
+    face.shutdown()
+
+    return [consumer.finish() for consumer in consumers]
+
+
+def find_knee(stages):
+    """Returns the sweep stage with the highest power (throughput divided by round trip time)."""
+    rows = stages.rows()
+    return rows[np.argmax(rows['power'])]
+
+
+def run_sweep(ip, prefix, mode, start, step, dwell, writer=None, stage_writer=None, max_stages=20,
+              loss_threshold=5.0, rtt_inflation=2.0, **consumer_options):
+    """Runs a capacity sweep on one prefix, stepping the send rate or window size upward.
+
+    Returns a MetricsBuffer with the throughput, latency and loss of every stage.
+    """
+
+    loop = asyncio.get_event_loop()
+
+    # start from the first stage's setting, with a window that doesn't adapt on its own
+    if mode == 'rate':
+        consumer_options.update(rate=(start, 'interests'), window=None)
+    else:
+        consumer_options.update(window=start, congestion_control='fixed', rate=None)
+    consumer = Consumer(ip, **consumer_options)
+
+    print(f"Sweeping {mode} from {start} in steps of {step}, {dwell} seconds per stage...")
+
+    # stream for longer than the sweep can take, since stages wait for their loss to be known
+    consumer.start(prefix, (dwell + 60) * max_stages, writer)
+    update_task = loop.create_task(consumer._update())
+    stages = loop.run_until_complete(consumer.sweep(mode, start, step, dwell, max_stages, loss_threshold, rtt_inflation, stage_writer))
+
+    consumer.stop()
+    update_task.cancel()
+    consumer._face.shutdown()
+    consumer.finish()
+
+    stages.close()
+    return stages
+
+
 def rate_parser(string):
-    """Parses the rate argument."""
-    try:
-        parsed_rate = float(string)
-    except ValueError:
+    """Parses the rate argument into a (value, unit) pair.
+
+    Plain numbers are interests per second, and numbers ending in M, Mbit or Mbps are megabits of data per second.
+    """
+    match = re.fullmatch(r'([0-9]*\.?[0-9]+)\s*(m|mbit|mbps|mbit/s)?', string.strip().lower())
+    if match is None or float(match.group(1)) <= 0:
         raise argparse.ArgumentTypeError("Error in parsing rate parameter, please enter a valid one")
-    return parsed_rate
+    return float(match.group(1)), 'mbps' if match.group(2) is not None else 'interests'
 
 
 def main():
@@ -285,11 +780,31 @@ def main():
 
     parser.add_argument("-p", "--prefix", help="the prefix to request data from", action="append", default=["/ndn/external/test"])
     parser.add_argument("-t", "--time", help="the number of seconds to run each stream for", type=int, default=10)
-    parser.add_argument("-f", "--filename", help="the output file to store data to (in CSV form)")
+    parser.add_argument("-f", "--filename", help="the output file to store data to")
+    parser.add_argument("--format", help="the output file format", choices=list(OUTPUT_FORMATS), default="csv")
+    parser.add_argument("--fsync_interval", help="the number of seconds between writes of buffered output to disk", type=float, default=1.0)
     parser.add_argument("-i", "--ipaddress", help="the ip address to tunnel to", default="10.10.1.1")
-    #  parser.add_argument("-r", "--rate", help="the rate at which interests are sent", type=rate_parser, default="0.00001")
+    parser.add_argument("-r", "--rate", help="pace interests to this many per second, or to this many megabits of data per second with an M suffix (e.g. 20M), when not using --window", type=rate_parser)
+    parser.add_argument("--data_size", help="the expected data packet size in bytes, used to pace by megabits per second before any data arrives", type=int, default=1000)
     parser.add_argument("-v", "--verbosity", help="increase output verbosity", choices=[0, 1, 2], type=int, default=0)
     parser.add_argument("-d", "--demo", help="enable demo mode (more intuitive printouts)", action="store_true")
+    parser.add_argument("-w", "--window", help="fetch with a congestion window of this initial size instead of a fixed send rate", type=int)
+    parser.add_argument("--cc", help="the congestion control algorithm for windowed fetching", choices=CONGESTION_CONTROLS, default="aimd")
+    parser.add_argument("--reliable", help="retransmit timed out and nacked interests using an estimated retransmission timeout", action="store_true")
+    parser.add_argument("--max_retries", help="the maximum number of retransmissions per interest in reliable mode", type=int, default=3)
+    parser.add_argument("--lifetime", help="the interest lifetime in milliseconds (reliable mode uses the estimated retransmission timeout)", type=int)
+    parser.add_argument("--max_outstanding", help="the maximum number of outstanding interests, sending blocks while this many are pending", type=int, default=65536)
+    parser.add_argument("--shards", help="the number of workers the producer shards each prefix across (server_stream.py --workers), naming interests /prefix/<seq mod N>/<seq>", type=int, default=1)
+    parser.add_argument("--sweep", help="find the saturation point of each prefix by stepping the send rate or a fixed window size upward", choices=SWEEP_MODES)
+    parser.add_argument("--sweep_start", help="the send rate (interests per second) or window size of the first sweep stage", type=float)
+    parser.add_argument("--sweep_step", help="how much the send rate or window size grows each sweep stage", type=float)
+    parser.add_argument("--dwell", help="the number of seconds each sweep stage lasts", type=float, default=5)
+    parser.add_argument("--max_stages", help="the maximum number of sweep stages", type=int, default=20)
+    parser.add_argument("--loss_threshold", help="stop sweeping once a stage loses more than this percentage of interests", type=float, default=5.0)
+    parser.add_argument("--rtt_inflation", help="stop sweeping once a stage's median round trip time is this many times that of the first stage", type=float, default=2.0)
+    parser.add_argument("--batch_udp", help="batch interests and data per event loop tick, with sendmmsg and recvmmsg where available", action="store_true")
+    parser.add_argument("-c", "--concurrent", help="stream all prefixes at the same time over one face", action="store_true")
+    parser.add_argument("-s", "--start_at", help="wait until this wall-clock time (seconds since the epoch) before streaming", type=float)
 
     args = parser.parse_args()
 
@@ -297,34 +812,77 @@ def main():
     if len(args.prefix) > 1:
         args.prefix.pop(0)
 
-    # create a list for storing dataframes
-    final_data = []
-
-    # run experiment once for provided prefix
+    # store output to file as it is produced if filename option is enabled
+    writers = []
     for namespace in args.prefix:
-        consumer = Consumer(args.ipaddress, verbose=args.verbosity)
-        #  TODO: add rate functionality back in if needed
-
-        # run consumer and put output into dataframe
-        final_data.append(consumer.run(namespace, args.time))
-
+        if args.filename is not None:
+            writers.append(create_writer(args.filename + namespace.replace('/', '-'), METRIC_COLUMNS, args.format, args.fsync_interval))
+        else:
+            writers.append(None)
+
+    consumer_options = {'verbose': args.verbosity,
+                        'window': args.window,
+                        'congestion_control': args.cc,
+                        'max_retries': args.max_retries if args.reliable else None,
+                        'lifetime': args.lifetime,
+                        'max_outstanding': args.max_outstanding,
+                        'rate': args.rate,
+                        'data_size': args.data_size,
+                        'batch_udp': args.batch_udp,
+                        'shards': args.shards}
+
+    # create a list for storing metrics buffers
+    final_data = []
 
-    # store output to file if filename option is enabled
-    if args.filename is not None:
-        i = 0
-        for dataframe in final_data:
-            dataframe.to_csv(args.filename + args.prefix[i].replace('/', '-') + '.csv', index=False)
-            i += 1
+    if args.sweep is not None:
+        # step each prefix towards saturation in turn
+        default_start, default_step = (1000, 1000) if args.sweep == 'rate' else (2, 2)
+        start = args.sweep_start if args.sweep_start is not None else default_start
+        step = args.sweep_step if args.sweep_step is not None else default_step
+
+        for namespace, writer in zip(args.prefix, writers):
+            stage_writer = None
+            if args.filename is not None:
+                # lead with sweep- so that analysis.py doesn't mistake the stages for a result file
+                directory, base = os.path.split(args.filename)
+                stage_filename = os.path.join(directory, 'sweep-' + base + namespace.replace('/', '-'))
+                stage_writer = create_writer(stage_filename, SWEEP_COLUMNS, args.format, args.fsync_interval)
+            stages = run_sweep(args.ipaddress, namespace, args.sweep, start, step, args.dwell, writer, stage_writer,
+                               args.max_stages, args.loss_threshold, args.rtt_inflation, **consumer_options)
+
+            print(f"\nThroughput-latency curve for {namespace}:")
+            stages.print_rows()
+            knee = find_knee(stages)
+            print(f"Knee at {args.sweep} {knee['target']:g}: {knee['throughput_kbps']:.1f} kbps with a median round trip time of {knee['rtt_p50_ms']:.3f} ms\n")
+        return
+
+    if args.concurrent:
+        # run all prefixes at once so they compete for bandwidth
+        final_data = run_concurrently(args.ipaddress, args.prefix, args.time, writers, start_time=args.start_at, **consumer_options)
+    else:
+        # set up every consumer before the start barrier so none of that time is spent after it
+        consumers = [Consumer(args.ipaddress, **consumer_options) for namespace in args.prefix]
+
+        if args.start_at is not None:
+            for consumer in consumers:
+                consumer.connect()
+            wait_until(args.start_at)
+
+        # run experiment once for provided prefix
+        for consumer, namespace, writer in zip(consumers, args.prefix, writers):
+            # run consumer and keep its metrics
+            final_data.append(consumer.run(namespace, args.time, writer))
 
     # print results to stdout
     if not args.demo:
-        for dataframe in final_data:
-            print(dataframe)
+        for metrics in final_data:
+            metrics.print_rows()
 
     # print modified results for demo
     if args.demo:
-        for dataframe in final_data:
-            print(dataframe[['timestamp', 'packet_loss_percent', 'total_data_goodput_kilobytes', 'bitrate_kbps', 'latency']])
+        for metrics in final_data:
+            metrics.print_rows(['timestamp', 'packet_loss_percent', 'total_data_goodput_kilobytes', 'bitrate_kbps', 'latency', 'average_latency', 'rtt_p99_ms'])
+            dataframe = metrics.rows()
             #  print(f"Average bitrate: {dataframe.bitrate_kbps.sum() / len(dataframe.index)} kbps")
             #  print(len(dataframe.index))
             #  print(f"Time to first byte: {dataframe.loc[0, 'time_to_first_byte_ms']} ms")
@@ -354,4 +912,3 @@ main()
 #  adjust verbosity implementation
 #  revamp timing and reporting metrics
 #  fix time to first byte implementation
-#  add average latency implementation
@@ -0,0 +1,183 @@
+"""
+Congestion windows for pipelined consumers, modeled on ndncatchunks
+
+"""
+import time
+
+
+# the supported congestion control algorithms
+CONGESTION_CONTROLS = ['aimd', 'cubic', 'fixed']
+
+
+class AimdWindow():
+    """Additive-increase, multiplicative-decrease congestion window with slow start."""
+
+    def __init__(self, initial_window=2, min_window=1, increase_step=1.0, decrease_factor=0.5):
+        self._window = float(initial_window)
+        self._min_window = min_window
+        self._increase_step = increase_step
+        self._decrease_factor = decrease_factor
+
+        # slow start until the first loss
+        self._ssthresh = float('inf')
+
+        # losses of interests sent before this sequence number belong to a window that was already decreased
+        self._recovery_point = 0
+
+        self._num_decreases = 0
+
+
+    def get_window(self):
+        return self._window
+
+
+    def get_num_decreases(self):
+        return self._num_decreases
+
+
+    def on_data(self):
+        """Grows the window after an interest is satisfied."""
+        if self._window < self._ssthresh:
+            self._window += self._increase_step
+        else:
+            self._window += self._increase_step / self._window
+
+
+    def on_loss(self, seq, next_seq):
+        """Shrinks the window at most once per window of interests.
+
+        seq is the sequence number of the lost interest and next_seq the next one to be sent.
+        Returns True if the window was decreased.
+        """
+        if seq < self._recovery_point:
+            return False
+
+        self._decrease()
+        self._recovery_point = next_seq
+        self._num_decreases += 1
+        return True
+
+
+    def _decrease(self):
+        self._ssthresh = max(self._min_window, self._window * self._decrease_factor)
+        self._window = self._ssthresh
+
+
+
+class CubicWindow(AimdWindow):
+    """CUBIC congestion window (RFC 8312) with slow start."""
+
+    CUBIC_C = 0.4
+    CUBIC_BETA = 0.7
+
+    def __init__(self, initial_window=2, min_window=1):
+        super().__init__(initial_window, min_window, decrease_factor=self.CUBIC_BETA)
+
+        # window size before the last decrease and when it happened
+        self._wmax = 0.0
+        self._last_wmax = 0.0
+        self._last_decrease = time.time()
+
+
+    def on_data(self):
+        """Grows the window along the cubic curve anchored at the last decrease."""
+        if self._window < self._ssthresh:
+            self._window += 1
+            return
+
+        t = time.time() - self._last_decrease
+        k = ((self._wmax * (1 - self.CUBIC_BETA)) / self.CUBIC_C) ** (1 / 3)
+        target = self.CUBIC_C * (t - k) ** 3 + self._wmax
+
+        # grow towards the cubic target, by at least a small step when below it
+        if target > self._window:
+            self._window += (target - self._window) / self._window
+        else:
+            self._window += 0.01 / self._window
+
+
+    def _decrease(self):
+        # fast convergence: release bandwidth when the window keeps shrinking
+        if self._window < self._last_wmax:
+            self._wmax = self._window * (1 + self.CUBIC_BETA) / 2
+        else:
+            self._wmax = self._window
+        self._last_wmax = self._window
+
+        super()._decrease()
+        self._last_decrease = time.time()
+
+
+
+class FixedWindow(AimdWindow):
+    """Window that keeps the size it is set to, regardless of data and losses."""
+
+    def on_data(self):
+        pass
+
+
+    def on_loss(self, seq, next_seq):
+        return False
+
+
+    def set_window(self, window):
+        self._window = float(window)
+
+
+
+def create_window(congestion_control, initial_window):
+    """Returns a congestion window for the given algorithm name."""
+    if congestion_control == 'cubic':
+        return CubicWindow(initial_window)
+    if congestion_control == 'fixed':
+        return FixedWindow(initial_window)
+    return AimdWindow(initial_window)
+
+
+
+class TokenBucket():
+    """Token bucket that paces sends to an average rate of tokens per second.
+
+    Tokens accumulate while the sender sleeps, so every wakeup can send a batch and the rate
+    holds even when the event loop wakes up late. At most burst_time seconds of tokens are kept.
+    """
+
+    def __init__(self, rate, burst_time=0.02):
+        self._rate = rate
+        self._burst_time = burst_time
+        self.reset()
+
+
+    def reset(self):
+        """Empties the bucket, starting pacing from now."""
+        self._tokens = 0.0
+        self._last_refill = time.perf_counter()
+
+
+    def _refill(self, cost):
+        now = time.perf_counter()
+        capacity = max(self._rate * self._burst_time, cost)
+        self._tokens = min(self._tokens + (now - self._last_refill) * self._rate, capacity)
+        self._last_refill = now
+
+
+    def take(self, cost=1):
+        """Returns how many sends costing cost tokens each are allowed now, removing their tokens."""
+        self._refill(cost)
+        count = int(self._tokens // cost)
+        self._tokens -= count * cost
+        return count
+
+
+    def get_delay(self, cost=1):
+        """Returns the number of seconds until a send costing cost tokens is allowed."""
+        self._refill(cost)
+        return max(cost - self._tokens, 0) / self._rate
+
+
+    def get_rate(self):
+        return self._rate
+
+
+    def set_rate(self, rate):
+        self._rate = rate
@@ -0,0 +1,339 @@
+import time
+import argparse
+import asyncio
+from pyndn import Name
+from pyndn import Interest
+from pyndn.transport import UdpTransport
+from pyndn.threadsafe_face import ThreadsafeFace
+from congestion import create_window, CONGESTION_CONTROLS
+from latency import LatencyHistogram, RttEstimator
+from metrics import MetricsBuffer, create_writer, OUTPUT_FORMATS
+
+
+def dump(*list):
+    """Prints all parameters"""
+
+    result = ""
+    for element in list:
+        result += (element if type(element) is str else str(element)) + " "
+    print(result)
+
+
+# the columns of each fetch report and their types
+REPORT_COLUMNS = [('prefix', 'U64'),
+                  ('version', 'i8'),
+                  ('num_segments', 'i8'),
+                  ('file_size_bytes', 'i8'),
+                  ('elapsed_time_s', 'f8'),
+                  ('time_to_first_byte_ms', 'f8'),
+                  ('throughput_kbps', 'f8'),
+                  ('interests_sent', 'i8'),
+                  ('num_timeouts', 'i8'),
+                  ('num_nacks', 'i8'),
+                  ('num_retransmissions', 'i8'),
+                  ('average_latency_ms', 'f8'),
+                  ('latency_p50_ms', 'f8'),
+                  ('latency_p99_ms', 'f8'),
+                  ('completed', 'i8')]
+
+
+class FileFetcher():
+    """Fetches a versioned, segmented file with a pipeline of interests and reassembles it in order."""
+
+    def __init__(self, ip, verbose=0, window=16, congestion_control='aimd', max_retries=15, face=None):
+        self.UPDATE_TIMING = 0.001
+
+        # establish asyncio loop
+        self._loop = asyncio.get_event_loop()
+
+        # control verbosity
+        self._verbose = verbose
+
+        # establish a local or remote face
+        self._face = setup_face(self._loop, ip) if face is None else face
+
+        # the file being fetched, known once the first segment arrives
+        self._prefix = None
+        self._version = None
+        self._num_segments = None
+        self._output = None
+
+        # congestion window and retransmission timer for the pipeline
+        self._window = create_window(congestion_control, window)
+        self._rto = RttEstimator()
+        self._max_retries = max_retries
+        self._in_flight = 0
+
+        # the next segment to request, and the send time and number of retries of each outstanding one
+        self._next_segment = 0
+        self._send_times = {}
+        self._retries = {}
+        # timeouts of segments before this one don't back off the timer again
+        self._backoff_point = 0
+
+        # segments recieved out of order, waiting for the ones before them to be written
+        self._reorder_buffer = {}
+        self._next_to_write = 0
+
+        # set once the whole file is written or the fetch fails
+        self._finished = asyncio.Event()
+        self._completed = False
+
+        # keep track of some performance metrics
+        self._interests_sent = 0
+        self._num_timeouts = 0
+        self._num_nacks = 0
+        self._num_retransmissions = 0
+        self._bytes_written = 0
+        self._rtt = LatencyHistogram()
+        self._time = {'start': 0, 'first_byte': None, 'end': None}
+
+        print(f"Consumer instance created with UDP tunnel to {ip}!")
+
+
+    def fetch(self, prefix, filename):
+        """Fetches the latest version of the file published under prefix into filename.
+
+        Returns a dictionary containing data for analysis.
+        """
+
+        print(f"Fetching {prefix} into {filename}...")
+
+        self._prefix = Name(prefix)
+        self._output = open(filename, 'wb')
+        self._time['start'] = time.time()
+
+        # discover the version with the first segment
+        interest = Interest(self._prefix)
+        interest.setCanBePrefix(True)
+        interest.setMustBeFresh(True)
+        self._express(interest, 0)
+
+        update_task = self._loop.create_task(self._update())
+        self._loop.run_until_complete(self._finished.wait())
+        update_task.cancel()
+
+        self._face.shutdown()
+        self._output.close()
+
+        return self.status_report()
+
+
+    def _express(self, interest, segment):
+        """Sends an interest for a segment with the current retransmission timeout as its lifetime."""
+        interest.setInterestLifetimeMilliseconds(self._rto.get_rto())
+        self._send_times[segment] = time.time()
+        self._face.expressInterest(interest, self.onData, self.onTimeout, self.onNetworkNack)
+        self._interests_sent += 1
+        self._in_flight += 1
+
+        if self._verbose >= 2:
+            dump("Send interest with name", interest.getName().toUri())
+
+
+    def _fill_window(self):
+        """Requests the next segments until the congestion window is full or every segment is requested."""
+        while self._in_flight < int(self._window.get_window()) and self._next_segment < self._num_segments:
+            name = Name(self._prefix).appendVersion(self._version).appendSegment(self._next_segment)
+            interest = Interest(name)
+            interest.setMustBeFresh(False)
+            self._express(interest, self._next_segment)
+            self._next_segment += 1
+
+
+    def _get_segment(self, name):
+        """Returns the segment number of a data or interest name, or 0 for the version discovery interest."""
+        if name.size() == self._prefix.size():
+            return 0
+        return name.get(-1).toSegment()
+
+
+    def onData(self, interest, data):
+        """Called when a segment is recieved."""
+
+        self._in_flight -= 1
+        name = data.getName()
+        segment = name.get(-1).toSegment()
+
+        if self._time['first_byte'] is None:
+            self._time['first_byte'] = time.time()
+
+        # the first segment tells us the version and the number of segments
+        if self._version is None:
+            self._version = name.get(-2).toVersion()
+            self._num_segments = data.getMetaInfo().getFinalBlockId().toSegment() + 1
+            self._next_segment = 1
+            if self._verbose >= 1:
+                dump("Fetching version", self._version, "with", self._num_segments, "segments")
+
+        # measure round trip times only on first transmissions
+        send_time = self._send_times.pop(segment, None)
+        if segment in self._retries:
+            del self._retries[segment]
+        elif send_time is not None:
+            rtt = (time.time() - send_time) * 1000
+            self._rtt.record(rtt)
+            self._rto.add_measurement(rtt)
+
+        self._window.on_data()
+        self._store(segment, data.getContent().buf())
+        self._fill_window()
+
+
+    def _store(self, segment, content):
+        """Writes a segment, or holds it until every segment before it has been written."""
+
+        if segment < self._next_to_write or segment in self._reorder_buffer:
+            return
+        self._reorder_buffer[segment] = content
+
+        while self._next_to_write in self._reorder_buffer:
+            content = self._reorder_buffer.pop(self._next_to_write)
+            self._output.write(content)
+            self._bytes_written += len(content)
+            self._next_to_write += 1
+
+        if self._next_to_write == self._num_segments:
+            self._finish(True)
+
+
+    def onTimeout(self, interest):
+        """Called when an interest for a segment times out."""
+        self._num_timeouts += 1
+        if self._verbose >= 2:
+            dump("Time out for interest", interest.getName().toUri())
+
+        segment = self._get_segment(interest.getName())
+
+        # back off the retransmission timer once per round of interests
+        if segment >= self._backoff_point:
+            self._rto.backoff()
+            self._backoff_point = self._next_segment
+        self._on_loss(interest, segment)
+
+
+    def onNetworkNack(self, interest, networkNack):
+        """Called when an interest for a segment is responded to with a nack."""
+        self._num_nacks += 1
+        if self._verbose >= 2:
+            dump("Network nack for interest", interest.getName().toUri())
+
+        self._on_loss(interest, self._get_segment(interest.getName()))
+
+
+    def _on_loss(self, interest, segment):
+        """Shrinks the window and requests a lost segment again, giving up after max_retries."""
+
+        self._in_flight -= 1
+        self._window.on_loss(segment, self._next_segment)
+
+        retries = self._retries.get(segment, 0)
+        if retries >= self._max_retries:
+            print(f"Giving up on segment {segment} after {retries} retransmissions.")
+            self._finish(False)
+            return
+
+        self._retries[segment] = retries + 1
+        self._num_retransmissions += 1
+        self._express(interest, segment)
+
+
+    def _finish(self, completed):
+        if self._finished.is_set():
+            return
+        self._completed = completed
+        self._time['end'] = time.time()
+        self._finished.set()
+
+
+    async def _update(self):
+        """Updates events on this consumer's face."""
+        while True:
+            self._face.processEvents()
+            await asyncio.sleep(self.UPDATE_TIMING)
+
+
+    def status_report(self):
+        """Returns a dictionary containing performance information, and optionally prints performance metrics for this fetch."""
+
+        elapsed = self._time['end'] - self._time['start']
+        if self._time['first_byte'] is not None:
+            time_to_first_byte_ms = (self._time['first_byte'] - self._time['start']) * 1000
+        else:
+            time_to_first_byte_ms = float('nan')
+        throughput_kbps = (self._bytes_written * 8 / 1000) / elapsed if elapsed > 0 else 0
+        rtt = self._rtt.summary()
+
+        data = {'prefix': self._prefix.toUri(),
+                'version': -1 if self._version is None else self._version,
+                'num_segments': -1 if self._num_segments is None else self._num_segments,
+                'file_size_bytes': self._bytes_written,
+                'elapsed_time_s': elapsed,
+                'time_to_first_byte_ms': time_to_first_byte_ms,
+                'throughput_kbps': throughput_kbps,
+                'interests_sent': self._interests_sent,
+                'num_timeouts': self._num_timeouts,
+                'num_nacks': self._num_nacks,
+                'num_retransmissions': self._num_retransmissions,
+                'average_latency_ms': rtt['mean'],
+                'latency_p50_ms': rtt['p50'],
+                'latency_p99_ms': rtt['p99'],
+                'completed': int(self._completed)}
+
+        if self._verbose >= 1 or not self._completed:
+            print("\n--------------------------------------------")
+            print(f"{'Fetched' if self._completed else 'Failed to fetch'} {self._bytes_written} bytes in {elapsed:.5f} seconds ({throughput_kbps:.3f} kbps)")
+            print(f"{self._interests_sent} interests sent, {self._num_retransmissions} retransmissions")
+            print(f"{self._num_timeouts} timeouts, {self._num_nacks} nacks")
+            print(f"Latency to first byte: {time_to_first_byte_ms:.3f} ms")
+            print(f"Average latency: {rtt['mean']:.3f} ms (p50 {rtt['p50']:.3f}, p99 {rtt['p99']:.3f})")
+            print("--------------------------------------------\n")
+
+        return data
+
+
+
+def setup_face(loop, ip):
+    """Sets up a face that connects to a remote forwarder."""
+    udp_connection_info = UdpTransport.ConnectionInfo(ip, 6363)
+    udp_transport = UdpTransport()
+    return ThreadsafeFace(loop, udp_transport, udp_connection_info)
+
+
+def main():
+    """Fetches a file with the specified properties."""
+
+    # handle and specify arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-p", "--prefix", help="the prefix the file is published under", default="/ndn/external/file")
+    parser.add_argument("-o", "--output", help="the file to write the fetched data to", default="fetched.out")
+    parser.add_argument("-i", "--ipaddress", help="the ip address to tunnel to", default="10.10.1.1")
+    parser.add_argument("-v", "--verbosity", help="increase output verbosity", choices=[0, 1, 2], type=int, default=0)
+    parser.add_argument("-w", "--window", help="the initial congestion window size", type=int, default=16)
+    parser.add_argument("--cc", help="the congestion control algorithm", choices=CONGESTION_CONTROLS, default="aimd")
+    parser.add_argument("--max_retries", help="the maximum number of retransmissions per segment before giving up", type=int, default=15)
+    parser.add_argument("-r", "--repeat", help="the number of times to fetch the file", type=int, default=1)
+    parser.add_argument("-f", "--filename", help="the output file to store fetch reports to")
+    parser.add_argument("--format", help="the output file format", choices=list(OUTPUT_FORMATS), default="csv")
+
+    args = parser.parse_args()
+
+    # store a report of each fetch, streaming them to a file if filename option is enabled
+    writer = None
+    if args.filename is not None:
+        writer = create_writer(args.filename, REPORT_COLUMNS, args.format)
+    data = MetricsBuffer(REPORT_COLUMNS, writer=writer)
+
+    for i in range(0, args.repeat):
+        fetcher = FileFetcher(args.ipaddress, verbose=args.verbosity, window=args.window, congestion_control=args.cc,
+                              max_retries=args.max_retries)
+        data.append(fetcher.fetch(args.prefix, args.output))
+
+    # write out any remaining reports
+    data.close()
+
+    data.print_rows()
+
+
+main()
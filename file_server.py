@@ -0,0 +1,227 @@
+import os
+import mmap
+import time
+import argparse
+import asyncio
+import signal
+from collections import OrderedDict
+from pyndn import Name
+from pyndn import Data
+from pyndn.security import KeyChain
+from pyndn.threadsafe_face import ThreadsafeFace
+from pyndn.util import Blob
+from signing import Signer, SIGNING_MODES
+
+
+def dump(*list):
+    """Prints all parameters"""
+
+    result = ""
+    for element in list:
+        result += (element if type(element) is str else str(element)) + " "
+    print(result)
+
+
+
+class FileProducer():
+    """Publishes a file as versioned, segmented data packets under a certain namespace.
+
+    Data is named /prefix/<version>/<segment> and carries the last segment number as its
+    FinalBlockId. An interest for /prefix (or /prefix/<version>) with CanBePrefix set is
+    answered with the first segment, so fetchers can discover the version.
+    """
+
+    def __init__(self, filename, segment_size=8000, version=None, verbose=False, cache_size=10000, signing='asymmetric', hmac_key="powder-ndn"):
+        # create a KeyChain for signing data packets
+        self._key_chain = KeyChain()
+        self._signer = Signer(self._key_chain, signing, hmac_key)
+
+        # establish asyncio loop
+        self._loop = asyncio.get_event_loop()
+
+        # host data at the local forwarder, handling packets as soon as its socket is readable
+        self._face = ThreadsafeFace(self._loop)
+
+        # map the file so that only the segments asked for are read into memory
+        self._file = open(filename, 'rb')
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        if self._file_size != 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+        else:
+            self._mmap = None
+            self._view = memoryview(b'')
+
+        # split the file into segments, publishing an empty file as one empty segment
+        self._segment_size = segment_size
+        self._num_segments = max(1, -(-self._file_size // segment_size))
+
+        # version the file by its modification time (in milliseconds) unless one is given
+        if version is None:
+            version = int(os.fstat(self._file.fileno()).st_mtime * 1000)
+        self._version = version
+
+        # the name of the file without version or segment (set when run)
+        self._prefix = None
+
+        # the verbosity of diagnostic information
+        self._verbose = verbose
+
+        # bounded LRU cache of signed, wire-encoded segments keyed by segment number
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_hits = 0
+
+        # keep track of various performance metrics:
+        self._interests_recieved = 0
+        self._interests_satisfied = 0
+        self._data_sent = 0
+        self._initial_time = None
+
+        print(f"Producer instance created for {filename} ({self._file_size} bytes in {self._num_segments} segments).")
+
+
+    def run(self, namespace):
+        """Starts listening for interest packets in the given namespace."""
+
+        self._prefix = Name(namespace)
+
+        # Use the system default key chain and certificate name to sign commands.
+        self._face.setCommandSigningInfo(self._key_chain, self._key_chain.getDefaultCertificateName())
+        self._face.registerPrefix(self._prefix, self.onInterest, self.onRegisterFailed)
+
+        print(f"Publishing version {self._version} under {namespace}...")
+
+        # report and stop cleanly when interrupted or terminated
+        self._loop.add_signal_handler(signal.SIGINT, self.shutdown)
+        self._loop.add_signal_handler(signal.SIGTERM, self.shutdown)
+
+        # run the event loop until shutdown stops it
+        self._loop.run_forever()
+
+        self._face.shutdown()
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+    def onInterest(self, prefix, interest, transport, registeredPrefixId):
+        """Called when an interest for the specified name is recieved"""
+
+        self._interests_recieved += 1
+        if self._initial_time is None:
+            self._initial_time = time.time()
+
+        segment = self._get_segment(interest)
+        if segment is None:
+            if self._verbose:
+                dump("Ignored:", interest.getName().toUri())
+            return
+
+        encoding = self._cache.get(segment)
+        if encoding is None:
+            encoding = self._encode_segment(segment)
+            if self._cache_size > 0:
+                self._cache[segment] = encoding
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            self._cache_hits += 1
+            self._cache.move_to_end(segment)
+
+        transport.send(encoding)
+
+        if self._verbose:
+            dump("Replied to:", interest.getName().toUri())
+
+        self._interests_satisfied += 1
+        self._data_sent += len(encoding)
+
+
+    def _get_segment(self, interest):
+        """Returns the segment number an interest asks for, or None if it doesn't name a segment of this file."""
+
+        name = interest.getName()
+        depth = self._prefix.size()
+
+        # version discovery: answer with the first segment
+        if name.size() == depth or (name.size() == depth + 1 and name.get(depth).isVersion()):
+            if not interest.getCanBePrefix():
+                return None
+            if name.size() == depth + 1 and name.get(depth).toVersion() != self._version:
+                return None
+            return 0
+
+        if name.size() != depth + 2 or not name.get(depth).isVersion() or not name.get(depth + 1).isSegment():
+            return None
+        if name.get(depth).toVersion() != self._version:
+            return None
+
+        segment = name.get(depth + 1).toSegment()
+        return segment if segment < self._num_segments else None
+
+
+    def _encode_segment(self, segment):
+        """Returns the signed wire encoding of a segment of the file."""
+
+        name = Name(self._prefix).appendVersion(self._version).appendSegment(segment)
+        start = segment * self._segment_size
+
+        data = Data(name)
+        # the slice is copied once, when the packet is encoded
+        data.setContent(Blob(self._view[start:start + self._segment_size], False))
+        data.getMetaInfo().setFreshnessPeriod(3600 * 1000)
+        data.getMetaInfo().setFinalBlockId(Name.Component.fromSegment(self._num_segments - 1))
+        self._signer.sign(data)
+        return bytes(data.wireEncode().toBuffer())
+
+
+    def onRegisterFailed(self, prefix):
+        """Called when forwarder can't register prefix."""
+        dump("Register failed for prefix", prefix.toUri())
+        self.shutdown()
+
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.stop()
+        self.print_status_report()
+
+
+    def print_status_report(self):
+        """Prints performance metrics for this producer."""
+
+        print("\n----------------------------------")
+        print(f"Number of interests recieved: {self._interests_recieved}")
+        print(f"Number of segments sent: {self._interests_satisfied} of {self._num_segments}")
+        print(f"{self._data_sent} bytes of data packets sent.")
+        print("----------------------------------")
+        self._signer.print_status_report()
+        print(f"Cache hits: {self._cache_hits}")
+        print("----------------------------------\n")
+
+
+
+def main():
+
+    # handle and specify arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("file", help="the file to publish")
+    parser.add_argument("-p", "--prefix", help="the prefix to publish the file under", default="/ndn/external/file")
+    parser.add_argument("-s", "--segment_size", help="the number of bytes of the file in each data packet", type=int, default=8000)
+    parser.add_argument("-V", "--version", help="the version number to publish (defaults to the file's modification time in milliseconds)", type=int)
+    parser.add_argument("-v", "--verbosity", help="increase output verbosity", action="store_true")
+    parser.add_argument("--signing", help="the signature type used for data packets", choices=SIGNING_MODES, default="asymmetric")
+    parser.add_argument("--hmac_key", help="the shared key used for hmac signing", default="powder-ndn")
+    parser.add_argument("--cache_size", help="the number of signed segments to cache (0 to disable)", type=int, default=10000)
+
+    args = parser.parse_args()
+
+    producer = FileProducer(args.file, args.segment_size, args.version, verbose=args.verbosity, cache_size=args.cache_size,
+                            signing=args.signing, hmac_key=args.hmac_key)
+    producer.run(args.prefix)
+
+
+main()
@@ -0,0 +1,290 @@
+"""
+Per-packet round trip time and loss tracking for the consumers
+
+"""
+import numpy as np
+
+
+class OutstandingTable():
+    """Table of outstanding interests and their send times, keyed by sequence number.
+
+    At most limit interests can be outstanding at once. Sequence number seq lives in slot
+    seq % capacity of a ring that starts with limit slots and doubles whenever a new interest's
+    slot is still held by an older one, so a lost interest never holds up later ones.
+    """
+
+    EMPTY = -1
+
+    def __init__(self, limit=65536):
+        self._limit = limit
+        self._seqs = np.full(limit, self.EMPTY, dtype=np.int64)
+        self._times = np.zeros(limit)
+        self._capacity = limit
+        self._count = 0
+
+
+    def can_add(self, seq):
+        """Returns True if seq is already outstanding or fewer than limit interests are."""
+        return self._count < self._limit or self._seqs[seq % self._capacity] == seq
+
+
+    def add(self, seq, timestamp):
+        """Marks an interest as outstanding, or updates its send time if it is being retransmitted."""
+        slot = seq % self._capacity
+        if self._seqs[slot] != seq:
+            while self._seqs[slot] != self.EMPTY:
+                self._grow()
+                slot = seq % self._capacity
+            self._seqs[slot] = seq
+            self._count += 1
+        self._times[slot] = timestamp
+
+
+    def _grow(self):
+        """Doubles the number of slots, moving every outstanding interest to its new slot."""
+        occupied = self._seqs != self.EMPTY
+        seqs = self._seqs[occupied]
+        times = self._times[occupied]
+
+        self._capacity *= 2
+        self._seqs = np.full(self._capacity, self.EMPTY, dtype=np.int64)
+        self._times = np.zeros(self._capacity)
+        self._seqs[seqs % self._capacity] = seqs
+        self._times[seqs % self._capacity] = times
+
+
+    def get_send_time(self, seq):
+        """Returns the latest send time of an outstanding interest, or None if it isn't outstanding."""
+        slot = seq % self._capacity
+        if self._seqs[slot] != seq:
+            return None
+        return float(self._times[slot])
+
+
+    def remove(self, seq):
+        """Removes a completed interest. Returns False if it wasn't outstanding."""
+        slot = seq % self._capacity
+        if self._seqs[slot] != seq:
+            return False
+        self._seqs[slot] = self.EMPTY
+        self._count -= 1
+        return True
+
+
+    def get_limit(self):
+        return self._limit
+
+
+    def get_capacity(self):
+        return self._capacity
+
+
+    def __len__(self):
+        return self._count
+
+
+
+class LatencyHistogram():
+    """Log-linear (HDR-style) histogram of latencies with a fixed memory footprint.
+
+    Values are stored in microsecond buckets with roughly 1% relative precision.
+    """
+
+    def __init__(self, max_latency_ms=600000, sub_bucket_bits=7):
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._half_count = self._sub_bucket_count >> 1
+        self._max_value = int(max_latency_ms * 1000)
+        self._counts = np.zeros(self._bucket_index(self._max_value) + 1, dtype=np.int64)
+        self.reset()
+
+
+    def reset(self):
+        """Clears all recorded values."""
+        self._counts.fill(0)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+
+    def record(self, latency_ms):
+        """Records a single latency in milliseconds."""
+        value = min(max(int(latency_ms * 1000), 0), self._max_value)
+        self._counts[self._bucket_index(value)] += 1
+        self._count += 1
+        self._total += latency_ms
+        if latency_ms > self._max:
+            self._max = latency_ms
+
+
+    def _bucket_index(self, value):
+        """Returns the bucket for a value in microseconds."""
+        if value < self._sub_bucket_count:
+            return value
+        shift = value.bit_length() - (self._sub_bucket_count.bit_length() - 1)
+        return shift * self._half_count + (value >> shift)
+
+
+    def _bucket_values(self):
+        """Returns the midpoint (in milliseconds) of every bucket."""
+        indices = np.arange(len(self._counts))
+        shifts = np.maximum(indices // self._half_count - 1, 0)
+        lows = np.where(indices < self._sub_bucket_count, indices, (indices - shifts * self._half_count) << shifts)
+        return (lows + ((1 << shifts) - 1) / 2) / 1000
+
+
+    def get_count(self):
+        return self._count
+
+
+    def get_mean(self):
+        return self._total / self._count if self._count != 0 else 0
+
+
+    def get_max(self):
+        return self._max
+
+
+    def get_percentiles(self, percentiles):
+        """Returns the latency (in milliseconds) at each of the given percentiles (0 - 100)."""
+        if self._count == 0:
+            return [0 for p in percentiles]
+        ranks = np.ceil(np.array(percentiles) / 100 * self._count).clip(1, self._count)
+        indices = np.searchsorted(np.cumsum(self._counts), ranks)
+        return [min(value, self._max) for value in self._bucket_values()[indices].tolist()]
+
+
+    def summary(self):
+        """Returns a dictionary with the mean, median, 90th and 99th percentile, and maximum latency."""
+        p50, p90, p99 = self.get_percentiles([50, 90, 99])
+        return {'mean': self.get_mean(), 'p50': p50, 'p90': p90, 'p99': p99, 'max': self.get_max()}
+
+
+
+class RttEstimator():
+    """Retransmission timeout estimator following RFC 6298."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial_rto_ms=1000, min_rto_ms=200, max_rto_ms=60000, granularity_ms=1):
+        self._min_rto = min_rto_ms
+        self._max_rto = max_rto_ms
+        self._granularity = granularity_ms
+
+        # smoothed round trip time and its variation, unset until the first measurement
+        self._srtt = None
+        self._rttvar = None
+        self._rto = initial_rto_ms
+
+
+    def add_measurement(self, rtt_ms):
+        """Updates the timeout from a round trip time measured on a first transmission."""
+        if self._srtt is None:
+            self._srtt = rtt_ms
+            self._rttvar = rtt_ms / 2
+        else:
+            self._rttvar = (1 - self.BETA) * self._rttvar + self.BETA * abs(self._srtt - rtt_ms)
+            self._srtt = (1 - self.ALPHA) * self._srtt + self.ALPHA * rtt_ms
+
+        rto = self._srtt + max(self._granularity, self.K * self._rttvar)
+        self._rto = min(max(rto, self._min_rto), self._max_rto)
+
+
+    def backoff(self):
+        """Doubles the timeout after a retransmission timer expires."""
+        self._rto = min(self._rto * 2, self._max_rto)
+
+
+    def get_rto(self):
+        """Returns the current retransmission timeout in milliseconds."""
+        return self._rto
+
+
+    def get_srtt(self):
+        """Returns the smoothed round trip time in milliseconds (0 before any measurement)."""
+        return 0 if self._srtt is None else self._srtt
+
+
+
+class LossTracker():
+    """Attributes the outcome of every interest to the measurement window its first transmission was sent in.
+
+    Outcomes arrive up to an interest lifetime after the send, so a window's loss is only final
+    once every interest sent in it has been satisfied or lost. Like OutstandingTable, sequence
+    numbers are stored in slot seq % capacity, and the capacity doubles whenever a new interest's
+    slot is still held by an unresolved one.
+    """
+
+    # marker for sequence numbers whose outcome is already counted
+    RESOLVED = -1
+
+    def __init__(self, capacity=65536):
+        self._seqs = np.full(capacity, -1, dtype=np.int64)
+        self._windows = np.full(capacity, self.RESOLVED, dtype=np.int32)
+        self._capacity = capacity
+
+        # number of interests sent, resolved and lost per window
+        self._sent = []
+        self._resolved = []
+        self._lost = []
+
+
+    def on_send(self, seq, window):
+        """Records the window an interest was sent in, ignoring retransmissions."""
+
+        slot = seq % self._capacity
+        if self._seqs[slot] == seq:
+            return
+
+        while len(self._sent) <= window:
+            self._sent.append(0)
+            self._resolved.append(0)
+            self._lost.append(0)
+
+        while self._windows[slot] != self.RESOLVED:
+            self._grow()
+            slot = seq % self._capacity
+
+        self._seqs[slot] = seq
+        self._windows[slot] = window
+        self._sent[window] += 1
+
+
+    def _grow(self):
+        """Doubles the number of slots, moving every unresolved interest to its new slot."""
+        unresolved = self._windows != self.RESOLVED
+        seqs = self._seqs[unresolved]
+        windows = self._windows[unresolved]
+
+        self._capacity *= 2
+        self._seqs = np.full(self._capacity, -1, dtype=np.int64)
+        self._windows = np.full(self._capacity, self.RESOLVED, dtype=np.int32)
+        self._seqs[seqs % self._capacity] = seqs
+        self._windows[seqs % self._capacity] = windows
+
+
+    def on_outcome(self, seq, is_lost):
+        """Records whether the first transmission of an interest was satisfied or lost."""
+
+        slot = seq % self._capacity
+        window = self._windows[slot]
+        if self._seqs[slot] != seq or window == self.RESOLVED:
+            return
+
+        self._windows[slot] = self.RESOLVED
+        self._resolved[window] += 1
+        if is_lost:
+            self._lost[window] += 1
+
+
+    def is_resolved(self, window):
+        """Returns True once the outcome of every interest sent in a window is known."""
+        return window >= len(self._sent) or self._resolved[window] == self._sent[window]
+
+
+    def get_loss(self, window):
+        """Returns the number of interests sent and lost in a window, counting unresolved ones as lost."""
+        if window >= len(self._sent):
+            return 0, 0
+        return self._sent[window], self._lost[window] + self._sent[window] - self._resolved[window]
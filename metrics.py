@@ -0,0 +1,233 @@
+"""
+Fixed-memory storage and streaming output for consumer metrics
+
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+# the supported output formats and their file extensions
+OUTPUT_FORMATS = {'csv': '.csv', 'arrow': '.arrow', 'parquet': '.parquet'}
+
+
+class MetricsWriter(ABC):
+    """Streams rows of a structured array to a file.
+
+    Rows are batched in memory and written, flushed and fsynced together at most once
+    every fsync_interval seconds, so readers can tail the file while the consumer runs.
+    """
+
+    def __init__(self, filename, dtype, fsync_interval=1.0):
+        self._filename = filename
+        self._dtype = dtype
+        self._fsync_interval = fsync_interval
+        self._pending = []
+        self._last_sync = time.time()
+        self._file = open(filename, 'wb')
+
+
+    def write(self, rows):
+        """Queues rows for writing, writing everything queued if the sync interval has passed."""
+        self._pending.append(rows)
+        if time.time() - self._last_sync >= self._fsync_interval:
+            self.sync()
+
+
+    def sync(self):
+        """Writes all queued rows and forces them to disk."""
+        if len(self._pending) != 0:
+            self._write_batch(np.concatenate(self._pending))
+            self._pending = []
+        self._force_to_disk()
+        self._last_sync = time.time()
+
+
+    def _force_to_disk(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+    @abstractmethod
+    def _write_batch(self, rows):
+        """Writes a batch of rows to the file."""
+
+
+
+class CsvWriter(MetricsWriter):
+    """Streams rows to a CSV file."""
+
+    def __init__(self, filename, dtype, fsync_interval=1.0):
+        super().__init__(filename, dtype, fsync_interval)
+        self._file.write((','.join(dtype.names) + '\n').encode())
+
+
+    def _write_batch(self, rows):
+        self._file.write(''.join(','.join(str(value) for value in row) + '\n' for row in rows.tolist()).encode())
+
+
+
+class ArrowWriter(MetricsWriter):
+    """Streams rows to an Arrow IPC stream file, one record batch per sync."""
+
+    def __init__(self, filename, dtype, fsync_interval=1.0):
+        super().__init__(filename, dtype, fsync_interval)
+        import pyarrow
+        self._pyarrow = pyarrow
+        self._schema = self._create_schema()
+        self._writer = pyarrow.ipc.new_stream(self._file, self._schema)
+
+
+    def _create_schema(self):
+        fields = []
+        for name in self._dtype.names:
+            kind = self._dtype[name].kind
+            fields.append((name, self._pyarrow.string() if kind == 'U' else self._pyarrow.from_numpy_dtype(self._dtype[name])))
+        return self._pyarrow.schema(fields)
+
+
+    def _to_table(self, rows):
+        columns = [self._pyarrow.array(rows[name].tolist(), type=self._schema.field(name).type) for name in self._dtype.names]
+        return self._pyarrow.Table.from_arrays(columns, schema=self._schema)
+
+
+    def _write_batch(self, rows):
+        self._writer.write_table(self._to_table(rows))
+
+
+    def close(self):
+        self.sync()
+        # the end of the stream (or the Parquet footer) is only written on close
+        self._writer.close()
+        self._force_to_disk()
+        self._file.close()
+
+
+
+class ParquetWriter(ArrowWriter):
+    """Streams rows to a Parquet file, one row group per sync.
+
+    Note that the Parquet footer is only written on close.
+    """
+
+    def __init__(self, filename, dtype, fsync_interval=1.0):
+        MetricsWriter.__init__(self, filename, dtype, fsync_interval)
+        import pyarrow
+        import pyarrow.parquet
+        self._pyarrow = pyarrow
+        self._schema = self._create_schema()
+        self._writer = pyarrow.parquet.ParquetWriter(self._file, self._schema)
+
+
+
+def create_writer(filename, columns, file_format='csv', fsync_interval=1.0):
+    """Returns a writer for the given list of (name, dtype) columns.
+
+    The file extension for the format is appended to filename unless it already ends with it.
+    """
+    dtype = np.dtype(columns)
+    if not filename.endswith(OUTPUT_FORMATS[file_format]):
+        filename += OUTPUT_FORMATS[file_format]
+    if file_format == 'arrow':
+        return ArrowWriter(filename, dtype, fsync_interval)
+    if file_format == 'parquet':
+        return ParquetWriter(filename, dtype, fsync_interval)
+    return CsvWriter(filename, dtype, fsync_interval)
+
+
+
+class MetricsBuffer():
+    """Ring buffer of metrics rows backed by a preallocated NumPy structured array.
+
+    Rows are handed to the writer (if any) in chunks of flush_size as they are added,
+    so memory use stays constant however long the consumer runs. Only the most recent
+    capacity rows are kept in memory. Without a writer no row is ever dropped: the array
+    doubles in size whenever it fills up instead.
+    """
+
+    def __init__(self, columns, capacity=1024, flush_size=1, writer=None):
+        """Creates a buffer for the given list of (name, dtype) columns."""
+
+        self._dtype = np.dtype(columns)
+        self._rows = np.zeros(capacity, dtype=self._dtype)
+        self._capacity = capacity
+        self._flush_size = min(flush_size, capacity)
+
+        # total number of rows appended, and how many of those have been handed to the writer
+        self._count = 0
+        self._flushed = 0
+
+        self._writer = writer
+
+
+    def append(self, row):
+        """Adds a row, given as a dictionary keyed by column name."""
+
+        # keep every row when they aren't being written anywhere
+        if self._writer is None and self._count == self._capacity:
+            self._grow()
+
+        slot = self._rows[self._count % self._capacity]
+        for name in self._dtype.names:
+            slot[name] = row[name]
+        self._count += 1
+
+        if self._count - self._flushed >= self._flush_size:
+            self.flush()
+
+
+    def _grow(self):
+        """Doubles the number of rows held in memory (only while the buffer hasn't wrapped around)."""
+        rows = np.zeros(self._capacity * 2, dtype=self._dtype)
+        rows[:self._capacity] = self._rows
+        self._rows = rows
+        self._capacity *= 2
+
+
+    def flush(self):
+        """Hands all rows not yet written to the writer."""
+
+        if self._writer is not None and self._count > self._flushed:
+            self._writer.write(self._slice(self._flushed, self._count))
+        self._flushed = self._count
+
+
+    def close(self):
+        """Writes any remaining rows and closes the output file."""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+    def _slice(self, start, end):
+        """Returns rows start through end - 1 (which must still be in memory) in order."""
+        indices = np.arange(start, end) % self._capacity
+        return self._rows[indices]
+
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+
+    def rows(self):
+        """Returns the rows held in memory, oldest first."""
+        return self._slice(self._count - len(self), self._count)
+
+
+    def print_rows(self, columns=None):
+        """Prints the rows held in memory as a table."""
+
+        rows = self.rows()
+        columns = list(self._dtype.names) if columns is None else columns
+        widths = [max(len(name), 12) for name in columns]
+
+        print('  '.join(name.rjust(width) for name, width in zip(columns, widths)))
+        for row in rows[columns].tolist():
+            print('  '.join((value if isinstance(value, str) else f"{value:.6g}").rjust(width) for value, width in zip(row, widths)))
@@ -1,15 +1,14 @@
 import time
 import argparse
-import traceback
-import random
 import asyncio
+import signal
+import multiprocessing
+from collections import OrderedDict
 from pyndn import Name
 from pyndn import Data
-from pyndn import Face
 from pyndn.security import KeyChain
-from pyndn.threadsafe_face import ThreadsafeFace
-import numpy as np
-import pandas as pd
+from signing import Signer, SIGNING_MODES
+from wire import DataTemplate, create_face
 
 
 def dump(*list):
@@ -21,29 +20,61 @@ def dump(*list):
     print(result)
 
 
+# the per-worker counters shared with the parent process in multi-worker mode
+STAT_FIELDS = ['interests_recieved', 'interests_satisfied', 'cache_hits', 'signatures', 'signing_time']
+
 
 class Producer():
     """Hosts data under a certain namespace"""
 
-    def __init__(self, data_size, verbose=False):
+    def __init__(self, data_size, verbose=False, cache_size=10000, signing='asymmetric', hmac_key="powder-ndn", worker_index=0, num_workers=1, stats=None):
         # create a KeyChain for signing data packets
         self._key_chain = KeyChain()
         self._is_done = False
         self._num_interests = 0
         #  self._keyChain.createIdentityV2(Name("/ndn/identity"))
 
-        # host data at the local forwarder
-        self._face = Face()
+        # sign data packets with the selected signature type
+        self._signer = Signer(self._key_chain, signing, hmac_key)
+
+        # establish asyncio loop
+        self._loop = asyncio.get_event_loop()
+
+        # host data at the local forwarder, handling packets as soon as its socket is readable, and
+        # keep the transport under the face for scatter-gather writes
+        self._face, self._transport = create_face(self._loop)
 
         # immutable byte array to use as data
         self._byte_array = bytes(data_size)
 
+        # encode data from a template around the one shared byte array and send it with
+        # scatter-gather writes, unless the signature type needs PyNDN to build each packet
+        if self._signer.can_sign_buffers():
+            self._template = DataTemplate(self._byte_array, self._signer)
+        else:
+            self._template = None
+
         # the number of bytes contained in each data packet
         self._data_size = data_size
 
         # the verbosity of diagnostic information
         self._verbose = verbose
 
+        # bounded LRU cache of signed, wire-encoded data packets keyed by name (as lists of
+        # buffers, so cached packets share the payload)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        # data packets signed ahead of time for predictable sequence numbers
+        self._presigned = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # this producer's shard of the prefix when sharded across processes
+        self._worker_index = worker_index
+        self._num_workers = num_workers
+        # shared array that counters are exported to for the parent process
+        self._stats = stats
+
         # keep track of if the first interest has been recieved (for timing)
         self._is_first_interst = True
 
@@ -58,10 +89,25 @@ class Producer():
         print("Producer instance created.")
 
 
-    def run(self, namespace):
-        """Starts listening for interest packets in the given namespace."""
+    def run(self, namespace, presign=0):
+        """Starts listening for interest packets in the given namespace.
+
+        When sharded across N workers, worker i registers /namespace/i, which consumers
+        started with --shards N send sequence numbers congruent to i mod N under.
+        If presign is nonzero, data for sequence numbers 0 through presign - 1 (this
+        worker's share of them) is signed before any interests are accepted.
+        """
 
         prefix = Name(namespace)
+        if self._num_workers > 1:
+            prefix.append(str(self._worker_index))
+
+        # sign predictable sequence numbers ahead of time
+        if presign > 0:
+            print(f"Pre-signing data packets for sequence numbers below {presign}...")
+            for i in range(self._worker_index, presign, self._num_workers):
+                name = Name(prefix).append(str(i))
+                self._presigned[name.toUri()] = self._encode_data(name)
 
         # Use the system default key chain and certificate name to sign commands.
         self._face.setCommandSigningInfo(self._key_chain, self._key_chain.getDefaultCertificateName())
@@ -73,11 +119,16 @@ class Producer():
 
         print(f"Listening for interests under {namespace}...")
 
-        # Run the event loop forever. Use a short sleep to
-        # prevent the Producer from using 100% of the CPU.
-        while not self._is_done:
-            self._face.processEvents()
-            time.sleep(0.01)
+        # report and stop cleanly when interrupted or terminated
+        self._loop.add_signal_handler(signal.SIGINT, self.shutdown)
+        self._loop.add_signal_handler(signal.SIGTERM, self.shutdown)
+
+        # periodically export counters to the parent process
+        if self._stats is not None:
+            self._loop.call_soon(self._export_stats_periodically)
+
+        # run the event loop until shutdown stops it
+        self._loop.run_forever()
 
         # shutdown this face - TODO: figure out why this can't be done in the self.shutdown() method
         self._face.shutdown()
@@ -86,18 +137,27 @@ class Producer():
     def onInterest(self, prefix, interest, transport, registeredPrefixId):
         """Called when an interest for the specified name is recieved"""
 
+        interestName = interest.getName()
+
         # keep track of when first interest was recieved
         self._initial_time['download_time'] = time.time()
 
-        # set data to a byte array of a specified size
-        interestName = interest.getName()
-        data = Data(interestName)
-        data.setContent(self._byte_array)
-
-        # sign and send data
-        data.getMetaInfo().setFreshnessPeriod(3600 * 1000)
-        self._key_chain.sign(data, self._key_chain.getDefaultCertificateName())
-        transport.send(data.wireEncode().toBuffer())
+        # serve data from the pre-signed set or the cache, signing only on a miss
+        key = interestName.toUri()
+        encoding = self._presigned.get(key)
+        if encoding is None:
+            encoding = self._cache.get(key)
+            if encoding is None:
+                self._cache_misses += 1
+                encoding = self._encode_data(interestName, interest)
+                self._add_to_cache(key, encoding)
+            else:
+                self._cache_hits += 1
+                self._cache.move_to_end(key)
+        else:
+            self._cache_hits += 1
+
+        self._transport.send_buffers(encoding)
 
         # print additional information if verobse flag is set
         if self._verbose:
@@ -109,6 +169,50 @@ class Producer():
         self._num_interests += 1
 
 
+    def _export_stats(self):
+        """Copies this producer's counters into its slot of the shared stats array."""
+
+        values = [self._interests_recieved, self._interests_satisfied, self._cache_hits, self._signer.get_num_signatures(), self._signer.get_signing_time()]
+        offset = self._worker_index * len(STAT_FIELDS)
+        self._stats[offset:offset + len(STAT_FIELDS)] = values
+
+
+    def _export_stats_periodically(self):
+        self._export_stats()
+        if not self._is_done:
+            self._loop.call_later(1, self._export_stats_periodically)
+
+
+    def _encode_data(self, name, interest=None):
+        """Returns the signed wire encoding of a data packet with the given name as a list of buffers.
+
+        If given, the interest the data answers supplies the encoded name for the template.
+        """
+
+        if self._template is not None:
+            if interest is not None:
+                return self._template.encode_for_interest(interest)
+            return self._template.encode(name)
+
+        # set data to a byte array of a specified size
+        data = Data(name)
+        data.setContent(self._byte_array)
+
+        # sign and encode data
+        data.getMetaInfo().setFreshnessPeriod(3600 * 1000)
+        self._signer.sign(data)
+        return [bytes(data.wireEncode().toBuffer())]
+
+
+    def _add_to_cache(self, key, encoding):
+        """Stores an encoded data packet, evicting the least recently used one if full."""
+        if self._cache_size <= 0:
+            return
+        self._cache[key] = encoding
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+
     def onRegisterFailed(self, prefix):
         """Called when forwarder can't register prefix."""
         dump("Register failed for prefix", prefix.toUri())
@@ -118,6 +222,10 @@ class Producer():
     def shutdown(self):
         self._final_time['download_time'] = time.time()
         self._is_done = True
+        if self._stats is not None:
+            self._export_stats()
+        if self._loop is not None:
+            self._loop.stop()
         self.print_status_report()
 
 
@@ -132,20 +240,84 @@ class Producer():
             self._elapsed_time[key] = self._final_time[key] - self._initial_time[key]
 
         # calculate bitrate of interests sent
-        download_kbps = ((self._data_sent * 8) / 1000) / self._elapsed_time['download_time']
+        if 'download_time' in self._elapsed_time and self._elapsed_time['download_time'] > 0:
+            download_kbps = ((self._data_sent * 8) / 1000) / self._elapsed_time['download_time']
 
 
         print("\n----------------------------------")
+        if self._num_workers > 1:
+            print(f"Worker {self._worker_index} of {self._num_workers}")
         print(f"Number of interests recieved: {self._interests_recieved}")
         print(f"Number of interests satisfied: {self._interests_satisfied}")
         print("----------------------------------")
         # this probably isn't a useful metric, as the output interface will throttle this
         #  print(f"{self._data_sent / 1000} kilobytes sent for a bitrate of {download_kbps} kbps")
         print(f"{self._data_size * self._interests_satisfied} bytes of data sent.")
+        print("----------------------------------")
+        self._signer.print_status_report()
+        print("----------------------------------")
+        print(f"Cache hits: {self._cache_hits} ({len(self._presigned)} pre-signed)")
+        print(f"Cache misses (signatures computed): {self._cache_misses}")
+        print(f"Packets sent with scatter-gather writes: {self._transport.get_num_gathered()} ({self._transport.get_num_joined()} joined)")
         print("----------------------------------\n")
 
 
 
+def run_worker(args, worker_index, stats):
+    """Runs a single producer worker process."""
+    producer = Producer(args.data_size, verbose=args.verbosity, cache_size=args.cache_size, signing=args.signing,
+                        hmac_key=args.hmac_key, worker_index=worker_index, num_workers=args.workers, stats=stats)
+    producer.run(args.prefix, presign=args.presign)
+
+
+def run_workers(args):
+    """Runs args.workers producer processes that share one prefix, then reports their combined counters."""
+
+    # each worker registers its own shard component under the prefix, so the forwarder hands
+    # every interest to exactly one of them
+    print(f"Sharding {args.prefix} across {args.workers} workers (run consumers with --shards {args.workers})")
+
+    # fork explicitly, since this script runs main() when imported
+    context = multiprocessing.get_context('fork')
+    stats = context.RawArray('d', args.workers * len(STAT_FIELDS))
+    workers = [context.Process(target=run_worker, args=(args, i, stats)) for i in range(0, args.workers)]
+    for worker in workers:
+        worker.start()
+
+    # pass termination on to the workers so they can report before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: [worker.terminate() for worker in workers])
+
+    # wait for workers to finish (an interrupt reaches the workers directly)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+
+    print_aggregate_report(stats, args.workers, args.data_size)
+
+
+def print_aggregate_report(stats, num_workers, data_size):
+    """Prints performance metrics summed across all workers."""
+
+    totals = dict.fromkeys(STAT_FIELDS, 0)
+    print("\n==================================")
+    for i in range(0, num_workers):
+        values = dict(zip(STAT_FIELDS, stats[i * len(STAT_FIELDS):(i + 1) * len(STAT_FIELDS)]))
+        print(f"Worker {i}: {int(values['interests_satisfied'])} interests satisfied, {int(values['signatures'])} signatures")
+        for field, value in values.items():
+            totals[field] += value
+
+    print("----------------------------------")
+    print(f"Number of interests recieved (all workers): {int(totals['interests_recieved'])}")
+    print(f"Number of interests satisfied (all workers): {int(totals['interests_satisfied'])}")
+    print(f"{data_size * int(totals['interests_satisfied'])} bytes of data sent.")
+    print(f"Cache hits: {int(totals['cache_hits'])}")
+    print(f"{int(totals['signatures'])} signatures computed in {totals['signing_time']:.5f} seconds of worker time")
+    print("==================================\n")
+
+
 def main():
 
     # handle and specify arguments
@@ -154,12 +326,22 @@ def main():
     parser.add_argument("-p", "--prefix", help="the prefix to host data under", default="/ndn/external/test")
     parser.add_argument("-v", "--verbosity", help="increase output verbosity", action="store_true")
     parser.add_argument("-s", "--data_size", help="set the per-packet data size in bytes", type=int, default=1000)
+    parser.add_argument("--signing", help="the signature type used for data packets", choices=SIGNING_MODES, default="asymmetric")
+    parser.add_argument("--hmac_key", help="the shared key used for hmac signing", default="powder-ndn")
+    parser.add_argument("--cache_size", help="the number of signed data packets to cache (0 to disable)", type=int, default=10000)
+    parser.add_argument("--presign", help="pre-sign data for sequence numbers 0 through N-1 at startup", metavar="N", type=int, default=0)
+    parser.add_argument("-w", "--workers", help="the number of producer processes to shard the prefix across", type=int, default=1)
 
     args = parser.parse_args()
 
+    # shard the prefix across several producer processes if requested
+    if args.workers > 1:
+        run_workers(args)
+        return
+
     # host data under a user-specified name prefix
-    producer = Producer(args.data_size, verbose=args.verbosity)
-    producer.run(args.prefix)
+    producer = Producer(args.data_size, verbose=args.verbosity, cache_size=args.cache_size, signing=args.signing, hmac_key=args.hmac_key)
+    producer.run(args.prefix, presign=args.presign)
 
 
 main()
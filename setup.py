@@ -3,15 +3,56 @@ This script handles setup for the powder-ndn profile
 
 """
 import argparse
+import os
+import time
+import shlex
+import hashlib
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fabric import Connection
 from fabric.transfer import Transfer
 
 
+ROUTERS = ('up-cl', 'external-dn', 'internal-dn')
+
+# the result files written by client_stream.py and traffic_client.py in each client's home directory
+RESULT_PATTERN = 'data*-ndn-*'
+
+
+def run_parallel(hosts, task):
+    """Runs task(host) for every host name at once, with at most MAX_PARALLEL hosts in flight.
+
+    Prints and returns a dictionary of per-host results (the exception raised, on failure).
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as executor:
+        start = time.time()
+        futures = {executor.submit(task, host): host for host in hosts}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                results[host] = future.result()
+                print(f'[{host}] done after {time.time() - start:.1f}s')
+            except Exception as error:
+                results[host] = error
+                print(f'[{host}] failed after {time.time() - start:.1f}s: {error}')
+    return results
+
+
+def run_on_hosts(commands):
+    """Runs a list of commands in order on each host, with all hosts in parallel.
+
+    commands maps each host name to its list of commands.
+    """
+    def run_commands(host):
+        for cmd in commands[host]:
+            connection[host].run(cmd)
+    return run_parallel(commands.keys(), run_commands)
+
 
 def install_dtach():
     """Installs dtach on all connections."""
-    for c in connection.values():
-        c.run('sudo apt install dtach')
+    return run_parallel(connection.keys(), lambda host: connection[host].run('sudo apt install dtach'))
 
 
 def run_bg(this_connection, cmd, sockname='dtach'):
@@ -21,24 +62,22 @@ def run_bg(this_connection, cmd, sockname='dtach'):
 
 def create_faces():
     """Creates the relevant UDP faces between routers"""
-    connection['up-cl'].run('nfdc face create udp4://10.10.3.2')
-    connection['up-cl'].run('nfdc face create udp4://10.10.2.2')
-    connection['external-dn'].run('nfdc face create udp4://10.10.2.1')
-    connection['internal-dn'].run('nfdc face create udp4://10.10.3.1')
+    return run_on_hosts({'up-cl': ['nfdc face create udp4://10.10.3.2', 'nfdc face create udp4://10.10.2.2'],
+                         'external-dn': ['nfdc face create udp4://10.10.2.1'],
+                         'internal-dn': ['nfdc face create udp4://10.10.3.1']})
 
 
 def start_nlsr():
     """Starts the NLSR routing daemon on all servers"""
-    run_bg(connection['up-cl'], 'nlsr -f ~/nlsr/nlsr.conf')
-    run_bg(connection['external-dn'], 'nlsr -f ~/nlsr/nlsr.conf')
-    run_bg(connection['internal-dn'], 'nlsr -f ~/nlsr/nlsr.conf')
+    return run_parallel(ROUTERS, lambda host: run_bg(connection[host], 'nlsr -f ~/nlsr/nlsr.conf'))
 
 
 def start_ping_servers():
     """Starts ping servers on all three servers"""
-    run_bg(connection['up-cl'], 'ndnpingserver /ndn/up-cl/ping')
-    run_bg(connection['external-dn'], 'ndnpingserver /ndn/external/ping')
-    run_bg(connection['internal-dn'], 'ndnpingserver /ndn/internal/ping')
+    prefixes = {'up-cl': '/ndn/up-cl/ping',
+                'external-dn': '/ndn/external/ping',
+                'internal-dn': '/ndn/internal/ping'}
+    return run_parallel(prefixes.keys(), lambda host: run_bg(connection[host], f'ndnpingserver {prefixes[host]}'))
 
 
 def configure_network(internal_latency, internal_packet_loss, internal_bandwidth, external_latency, external_packet_loss, external_bandwidth):
@@ -70,67 +109,96 @@ def clear_qdiscs():
 
 def reset_nfd():
     """Restarts the NDN forwarding daemon on all routers."""
-    routers = ('up-cl', 'external-dn', 'internal-dn')
-    for router in routers:
-        connection[router].run('nfd-stop')
-        connection[router].run('nfd-start')
+    return run_on_hosts({router: ['nfd-stop', 'nfd-start'] for router in ROUTERS})
 
 
 def update_repositories():
     """Updates git repository on all nodes."""
-    for c in connection.values():
-        c.run('cd /local/repository && git stash && git checkout master && git pull')
+    return run_parallel(connection.keys(), lambda host: connection[host].run('cd /local/repository && git stash && git checkout master && git pull'))
 
 
 def set_caching(caching_state):
     """Turn caching in the network on or off."""
-    routers = ('up-cl', 'external-dn', 'internal-dn')
-    for router in routers:
-        if caching_state:
-            connection[router].run('nfdc cs config serve on')
-        else:
-            connection[router].run('nfdc cs config serve off')
+    if caching_state:
+        return run_parallel(ROUTERS, lambda host: connection[host].run('nfdc cs config serve on'))
+    else:
+        return run_parallel(ROUTERS, lambda host: connection[host].run('nfdc cs config serve off'))
 
 
 def set_servers(server_state):
     if server_state:
-        run_bg(connection['external-dn'], 'python3 /local/repository/server_stream.py -p /ndn/external/test')
-        run_bg(connection['internal-dn'], 'python3 /local/repository/server_stream.py -p /ndn/internal/test')
+        prefixes = {'external-dn': '/ndn/external/test', 'internal-dn': '/ndn/internal/test'}
+        run_parallel(prefixes.keys(), lambda host: run_bg(connection[host], f'python3 /local/repository/server_stream.py -p {prefixes[host]}'))
         print('servers on')
 
 
 def run_client(number):
     #  number = str(number)
     #  run_bg(connection['client' + number], f'python3 /local/repository/client_stream.py -p /ndn/external/test -p /ndn/internal/test -t 120 -f data{number} -i 155.98.37.73')
-    for i in range(1, 5):
-        run_bg(connection['client' + str(i)], f'python3 /local/repository/client_stream.py -p /ndn/external/test -p /ndn/internal/test -t 20 -f data{str(i)} -i 155.98.37.73')
+    # stream both prefixes concurrently so that both start at the synchronized time
+    start_at = synchronized_start_time()
+    return run_parallel(CLIENT_HOSTS.keys(), lambda host: run_bg(connection[host], f'python3 /local/repository/client_stream.py -p /ndn/external/test -p /ndn/internal/test -c -t 20 -f data{CLIENT_HOSTS[host]} -i 155.98.37.73 -s {start_at:.3f}'))
 
 
 def stream_on_all_nodes():
     """Start streaming on all client nodes."""
 
     # iterate only through client nodes
-    for name, c in connection.items():
-        if name[:6] == 'client':
-            run_bg(c, 'python3 /local/repository/client_stream.py -p /ndn/external/test -f data-{name} -i 155.98.37.73')
+    start_at = synchronized_start_time()
+    return run_parallel(CLIENT_HOSTS.keys(), lambda host: run_bg(connection[host], f'python3 /local/repository/client_stream.py -p /ndn/external/test -f data-{host} -i 155.98.37.73 -s {start_at:.3f}'))
+
+
+def synchronized_start_time():
+    """Returns a wall-clock start time far enough ahead for every client to launch and wait for it.
+
+    Clients rely on their NTP-synchronized clocks to start together.
+    """
+    start_at = time.time() + args.start_delay
+    print(f'Clients will start streaming at {time.ctime(start_at)} ({start_at:.3f})')
+    return start_at
 
 
 def fetch_data():
-    #  i = 1
-    #  for name, c in connection.items():
-        #  if name[:6] == 'client':
-            #  connection[f'client{str(i)}'].get(f"/users/ike091/data{str(i)}-ndn-external-test.csv", local=f"/mnt/c/Isaak/POWDER/powder-ndn/data/data{str(i)}-ndn-external-test.csv")
-            #  connection[f'client{str(i)}'].get(f"/users/ike091/data{str(i)}-ndn-internal-test.csv", local=f"/mnt/c/Isaak/POWDER/powder-ndn/data/data{str(i)}-ndn-internal-test.csv")
-            #  i += 1
+    """Collects result files from every client at once.
+
+    Each client packs its results into one compressed archive, which is transferred once
+    and checksummed before the remote copies are deleted.
+    """
+    return run_parallel(CLIENT_HOSTS.keys(), collect_results)
+
+
+def collect_results(host):
+    """Fetches and unpacks all result files from one client, returning their names."""
 
-    for i in range(1, 5):
-        connection['client' + str(i)].get(f"/users/ike091/data{str(i)}-ndn-external-test.csv", local=f"/mnt/c/Isaak/POWDER/powder-ndn/data/data{str(i)}-ndn-external-test.csv")
-        connection['client' + str(i)].get(f"/users/ike091/data{str(i)}-ndn-internal-test.csv", local=f"/mnt/c/Isaak/POWDER/powder-ndn/data/data{str(i)}-ndn-internal-test.csv")
-        connection['client' + str(i)].run(f"rm /users/ike091/data{str(i)}-ndn-external-test.csv")
-        connection['client' + str(i)].run(f"rm /users/ike091/data{str(i)}-ndn-internal-test.csv")
+    this_connection = connection[host]
+    remote_directory = f'/users/{USERNAME}'
+    archive = f'/tmp/results-{host}.tar.gz'
+    local_archive = os.path.join(args.data_directory, f'results-{host}.tar.gz')
 
-    #  connection['client1'].get("/users/ike091/data1-ndn-external-test.csv", local="/mnt/c/Isaak/POWDER/powder-ndn/data/data1-ndn-external-test.csv")
-    #  connection['client1'].get("/users/ike091/data1-ndn-internal-test.csv", local="/mnt/c/Isaak/POWDER/powder-ndn/data/data1-ndn-internal-test.csv")
+    # pack every result file into a single compressed archive
+    files = this_connection.run(f'cd {remote_directory} && ls -1 {RESULT_PATTERN}', hide=True).stdout.split()
+    file_list = ' '.join(shlex.quote(name) for name in files)
+    this_connection.run(f'cd {remote_directory} && tar czf {archive} {file_list}', hide=True)
+    remote_checksum = this_connection.run(f'sha256sum {archive}', hide=True).stdout.split()[0]
+
+    # transfer the archive once and verify it
+    this_connection.get(archive, local=local_archive)
+    with open(local_archive, 'rb') as f:
+        local_checksum = hashlib.sha256(f.read()).hexdigest()
+    if local_checksum != remote_checksum:
+        raise RuntimeError(f'checksum mismatch for {archive} ({local_checksum} != {remote_checksum})')
+
+    # unpack only plain files into the data directory
+    with tarfile.open(local_archive) as tar:
+        for member in tar.getmembers():
+            if member.isfile() and os.path.basename(member.name) == member.name:
+                tar.extract(member, args.data_directory)
+    os.remove(local_archive)
+
+    # only delete the remote copies once the local copy is verified
+    this_connection.run(f'cd {remote_directory} && rm {file_list} {archive}', hide=True)
+    print(f'[{host}] collected {len(files)} result files')
+    return files
 
 
 def parse_packet_loss(string):
@@ -184,9 +252,14 @@ parser.add_argument("-s", "--servers", help="turn servers on or off", choices=["
 
 # run clients
 parser.add_argument("-r", "--run_clients", help="start client streaming", action="store_true")
+parser.add_argument("--start_delay", help="seconds from now at which all clients start streaming together", type=float, default=10)
 
 # fetch streaming data
 parser.add_argument("-f", "--fetch", help="fetch client streaming data", action="store_true")
+parser.add_argument("-d", "--data_directory", help="the local directory to store fetched data in", default="/mnt/c/Isaak/POWDER/powder-ndn/data")
+
+# limit how many hosts are worked on at once
+parser.add_argument("-P", "--parallel", help="the maximum number of hosts to run each step on at once", type=int, default=32)
 
 
 args = parser.parse_args()
@@ -197,6 +270,7 @@ if args.address:
 else:
     ADDRESS_BEGINNING = f'pc{args.pc_number}-fortvm-'
 ADDRESS_END = '.emulab.net'
+MAX_PARALLEL = args.parallel
 USERNAME = 'ike091'
 
 ROUTER_HOSTS = {'up-cl': '3',
@@ -0,0 +1,141 @@
+"""
+Selectable data packet signing for the producers
+
+"""
+import time
+import hashlib
+import hmac
+from pyndn import Name
+from pyndn import DigestSha256Signature
+from pyndn import HmacWithSha256Signature
+from pyndn import KeyLocatorType
+from pyndn.util import Blob
+from pyndn.encoding import TlvWireFormat
+
+
+# the supported signing modes, from most to least expensive
+SIGNING_MODES = ['asymmetric', 'hmac', 'digest']
+
+
+class Signer():
+    """Signs data packets with a selectable signature type and tracks signing cost."""
+
+    def __init__(self, key_chain, mode='asymmetric', hmac_key="powder-ndn"):
+        if mode not in SIGNING_MODES:
+            raise ValueError(f"Unknown signing mode: {mode}")
+
+        self._key_chain = key_chain
+        self._mode = mode
+
+        # only look up the default certificate if it will be used
+        if mode == 'asymmetric':
+            self._certificate_name = key_chain.getDefaultCertificateName()
+
+        # signature template for digest signing
+        self._digest_signature = DigestSha256Signature()
+
+        # shared key and signature template for HMAC signing
+        self._hmac_key = Blob(hmac_key.encode())
+        self._hmac_signature = HmacWithSha256Signature()
+        self._hmac_signature.getKeyLocator().setType(KeyLocatorType.KEYNAME)
+        self._hmac_signature.getKeyLocator().setKeyName(Name("/ndn/powder/hmac"))
+
+        # encoded signature info for signing wire encodings directly (digest and HMAC only)
+        if mode == 'digest':
+            self._signature_info = TlvWireFormat.get().encodeSignatureInfo(self._digest_signature).toBytes()
+        elif mode == 'hmac':
+            self._signature_info = TlvWireFormat.get().encodeSignatureInfo(self._hmac_signature).toBytes()
+        else:
+            self._signature_info = None
+
+        # keyed hash with the HMAC key already absorbed, copied for each signature
+        self._hmac = hmac.new(self._hmac_key.toBytes(), digestmod=hashlib.sha256)
+
+        # keep track of signing cost for this mode
+        self._num_signatures = 0
+        self._signing_time = 0
+
+
+    def sign(self, data):
+        """Signs a data packet using this signer's mode."""
+
+        start = time.perf_counter()
+
+        if self._mode == 'digest':
+            # digest the signed portion directly rather than going through the PIB
+            data.setSignature(self._digest_signature)
+            encoding = data.wireEncode()
+            digest = hashlib.sha256(encoding.toSignedBytes()).digest()
+            data.getSignature().setSignature(Blob(bytearray(digest), False))
+        elif self._mode == 'hmac':
+            data.setSignature(self._hmac_signature)
+            self._key_chain.signWithHmacWithSha256(data, self._hmac_key)
+        else:
+            self._key_chain.sign(data, self._certificate_name)
+
+        self._signing_time += time.perf_counter() - start
+        self._num_signatures += 1
+
+
+    def can_sign_buffers(self):
+        """Returns True if this signer can sign a wire encoding given as buffers (digest and HMAC modes)."""
+        return self._signature_info is not None
+
+
+    def get_signature_info(self):
+        """Returns the encoded SignatureInfo TLV for sign_buffers."""
+        return self._signature_info
+
+
+    def get_signature_size(self):
+        """Returns the size of the signature values returned by sign_buffers (in bytes)."""
+        return hashlib.sha256().digest_size
+
+
+    def sign_buffers(self, buffers):
+        """Returns the signature value over the signed portion of a data packet given as a list of buffers.
+
+        The buffers must run from the Name TLV through the SignatureInfo TLV from get_signature_info.
+        """
+
+        start = time.perf_counter()
+
+        if self._mode == 'digest':
+            hash = hashlib.sha256()
+        elif self._mode == 'hmac':
+            hash = self._hmac.copy()
+        else:
+            raise ValueError(f"Cannot sign buffers in {self._mode} mode")
+
+        for buffer in buffers:
+            hash.update(buffer)
+        signature = hash.digest()
+
+        self._signing_time += time.perf_counter() - start
+        self._num_signatures += 1
+        return signature
+
+
+    def get_mode(self):
+        return self._mode
+
+
+    def get_num_signatures(self):
+        return self._num_signatures
+
+
+    def get_signing_time(self):
+        """Returns the total time spent signing (in seconds)."""
+        return self._signing_time
+
+
+    def print_status_report(self):
+        """Prints signing cost metrics for this signer."""
+
+        if self._num_signatures != 0:
+            per_signature_us = (self._signing_time / self._num_signatures) * 1000000
+        else:
+            per_signature_us = 0
+
+        print(f"Signing mode: {self._mode}")
+        print(f"{self._num_signatures} signatures computed in {self._signing_time:.5f} seconds ({per_signature_us:.2f} us per signature)")
@@ -1,3 +1,4 @@
+import re
 import time
 import argparse
 import asyncio
@@ -5,9 +6,12 @@ from pyndn import Name
 from pyndn import Interest
 from pyndn.transport import UdpTransport
 from pyndn.threadsafe_face import ThreadsafeFace
+from batched_transport import BatchedUdpTransport
 from pyndn import Face
+from latency import LatencyHistogram, OutstandingTable
+from congestion import TokenBucket
+from metrics import MetricsBuffer, create_writer, OUTPUT_FORMATS
 import numpy as np
-import pandas as pd
 
 
 def dump(*list):
@@ -19,10 +23,33 @@ def dump(*list):
     print(result)
 
 
+# the columns of each status report and their types
+REPORT_COLUMNS = [('prefix', 'U64'),
+                  ('data_recieved', 'i8'),
+                  ('interests_sent', 'i8'),
+                  ('packet_loss_rate', 'f8'),
+                  ('time_to_first_byte_ms', 'f8'),
+                  ('data_goodput_kilobytes', 'f8'),
+                  ('bitrate_kbps', 'f8'),
+                  ('num_timeouts', 'i8'),
+                  ('num_nacks', 'i8'),
+                  ('average_latency_ms', 'f8'),
+                  ('latency_p50_ms', 'f8'),
+                  ('latency_p90_ms', 'f8'),
+                  ('latency_p99_ms', 'f8'),
+                  ('latency_max_ms', 'f8'),
+                  ('target_interest_rate', 'f8'),
+                  ('achieved_interest_rate', 'f8')]
+
+
+# the interest lifetime PyNDN uses when none is set (in milliseconds)
+DEFAULT_LIFETIME = 4000
+
+
 class Consumer():
     """Creates a consumer for sending interest packets."""
 
-    def __init__(self, ip, verbose=0):
+    def __init__(self, ip, verbose=0, lifetime=None, max_outstanding=65536, rate=None, data_size=1000, batch_udp=False, face=None):
         # establish asyncio loop
         self._loop = asyncio.get_event_loop()
         self._loop.set_debug(True)
@@ -34,8 +61,12 @@ class Consumer():
         # control verbosity
         self._verbose = verbose
 
-        # establish a local or remote face
-        self._face = self._setup_face(ip)
+        # establish a local or remote face, unless one is shared with other consumers
+        self._shares_face = face is not None
+        self._face = setup_face(self._loop, ip, batch_udp) if face is None else face
+
+        # set once every interest has been answered or timed out
+        self._finished = asyncio.Event()
 
         # a prefix variable
         self._prefix = ""
@@ -46,6 +77,21 @@ class Consumer():
         self._num_nacks = 0
         self._num_timeouts = 0
         self._data_goodput = 0
+        # send time of every outstanding interest and the distribution of round trip times
+        self._outstanding = OutstandingTable(max_outstanding)
+        self._rtt = LatencyHistogram()
+        # interest lifetime in milliseconds (None uses the library default of DEFAULT_LIFETIME)
+        self._lifetime = lifetime
+        # set whenever an interest completes, so a blocked sender can continue
+        self._slot_freed = asyncio.Event()
+        # pace interests with a token bucket if a (value, unit) target rate is given, where the unit
+        # is interests or megabits of data per second (data_size is the expected data packet size)
+        self._rate = rate
+        self._data_size = data_size
+        self._pacer = None
+        if rate is not None:
+            value, unit = rate
+            self._pacer = TokenBucket(value * 1000000 if unit == 'mbps' else value)
         self._elapsed_time = {}
         self._initial_time = {}
         self._final_time = {}
@@ -55,19 +101,29 @@ class Consumer():
         print(f"Consumer instance created with UDP tunnel to {ip}!")
 
 
-    def _setup_face(self, ip):
-        """Sets up a face that connects to a remote forwarder."""
-        udp_connection_info = UdpTransport.ConnectionInfo(ip, 6363)
-        udp_transport = UdpTransport()
-        return ThreadsafeFace(self._loop, udp_transport, udp_connection_info)
-
-
-    def send_interests(self, prefix, num_interests, rate=0.00001):
+    def send_interests(self, prefix, num_interests, interval=0.00001):
         """Sends a specified number of interests to the specified prefix.
 
         Returns a dictionary containing data for analysis.
         """
 
+        self.start(prefix, num_interests, interval)
+
+        # create asyncio loop and run until explicitly shut down
+        self._loop.create_task(self._update())
+        self._loop.run_forever()
+
+        self._face.shutdown()
+
+        return self.status_report()
+
+
+    def start(self, prefix, num_interests, interval=0.00001):
+        """Schedules sending interests to the specified prefix, without running the event loop.
+
+        Interests are sent interval seconds apart unless this consumer has a target rate.
+        """
+
         print(f"Sending {num_interests} interests to {prefix}...")
 
         # start counting callbacks
@@ -80,37 +136,61 @@ class Consumer():
         else:
             self._prefix = prefix
 
+        self._loop.create_task(self._send_all(self._prefix, num_interests, interval))
 
-        # create asyncio loop and run until explicitly shut down
-        self._loop.create_task(self._update())
-        self._loop.create_task(self._send_all(self._prefix, num_interests, rate))
-        self._loop.run_forever()
-
-        self._face.shutdown()
 
-        return self.status_report()
+    async def wait_finished(self):
+        """Waits until every interest has been answered or timed out."""
+        await self._finished.wait()
 
 
-    async def _send_all(self, prefix, num_interests, rate):
+    async def _send_all(self, prefix, num_interests, interval):
         """Sends a specified amount of interests with sequentially numbered names."""
 
         # begin timing
         self._initial_time['send_time'] = self._initial_time['total_time'] = time.time()
         self._initial_time['time_to_first_byte'] = time.time()
+        if self._pacer is not None:
+            self._pacer.reset()
 
         # send a specified amount of interests
-        for i in range(0, num_interests):
-            self._send(prefix + str(i))
+        i = 0
+        while i < num_interests:
+
+            # send a batch of however many interests the pacer allows since the last wakeup
+            num_to_send = 1
+            if self._pacer is not None:
+                cost = self._get_send_cost()
+                num_to_send = self._pacer.take(cost)
+                if num_to_send == 0:
+                    await asyncio.sleep(self._pacer.get_delay(cost))
+                    continue
+
+            for j in range(min(num_to_send, num_interests - i)):
+                # block while max_outstanding interests are pending, checking again at least once
+                # per interest lifetime in case a wakeup is missed
+                while not self._outstanding.can_add(i):
+                    self._slot_freed.clear()
+                    try:
+                        await asyncio.wait_for(self._slot_freed.wait(), self._get_lifetime() / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                self._send(prefix + str(i), i)
+                i += 1
+
             # adjust interst sending rate
-            await asyncio.sleep(rate)
+            await asyncio.sleep(interval if self._pacer is None else 0)
 
         self._final_time['send_time'] = time.time()
 
 
-    def _send(self, name):
+    def _send(self, name, seq):
         """Send a singular interest."""
         interest = Interest(name)
         interest.setMustBeFresh(False)
+        if self._lifetime is not None:
+            interest.setInterestLifetimeMilliseconds(self._lifetime)
+        self._outstanding.add(seq, time.time())
         self._face.expressInterest(interest, self.onData, self.onTimeout, self.onNetworkNack)
         self._interests_sent += 1
 
@@ -128,6 +208,13 @@ class Consumer():
         self._callback_count += 1
         self._data_recieved += 1
 
+        # record the round trip time of this interest
+        seq = self._get_seq(interest)
+        send_time = self._outstanding.get_send_time(seq)
+        if send_time is not None:
+            self._rtt.record((time.time() - send_time) * 1000)
+        self._release(seq)
+
         if self._verbose >= 2:
             dump("Got data packet with name", data.getName().toUri())
             dump(data.getContent().toRawStr())
@@ -144,6 +231,7 @@ class Consumer():
         """Called when an interest packet times out."""
         self._callback_count += 1
         self._num_timeouts += 1
+        self._release(self._get_seq(interest))
         if self._verbose >= 2:
             dump("Time out for interest", interest.getName().toUri())
 
@@ -155,6 +243,7 @@ class Consumer():
         """Called when an interest packet is responded to with a nack."""
         self._callback_count += 1
         self._num_nacks += 1
+        self._release(self._get_seq(interest))
         if self._verbose >= 2:
             dump("Network nack for interest", interest.getName().toUri())
 
@@ -162,6 +251,32 @@ class Consumer():
             self.shutdown()
 
 
+    def _get_send_cost(self):
+        """Returns the tokens an interest costs: 1, or the expected size of its data packet in bits when pacing by bitrate."""
+
+        if self._rate[1] != 'mbps':
+            return 1
+        if self._data_recieved != 0:
+            return self._data_goodput / self._data_recieved * 8
+        return self._data_size * 8
+
+
+    def _get_lifetime(self):
+        """Returns the interest lifetime in milliseconds."""
+        return self._lifetime if self._lifetime is not None else DEFAULT_LIFETIME
+
+
+    def _get_seq(self, interest):
+        """Returns the sequence number of an interest sent by this consumer."""
+        return int(interest.getName().get(-1).toEscapedString())
+
+
+    def _release(self, seq):
+        """Frees an interest's slot in the outstanding table once it is finished."""
+        self._outstanding.remove(seq)
+        self._slot_freed.set()
+
+
     def status_report(self):
         """Returns a dictionary containing performance information, and optionally prints performance metrics for this consumer."""
 
@@ -184,11 +299,22 @@ class Consumer():
             print("Time to first byte could not be calculated.")
             time_to_first_byte_ms = 0
 
+        # compare the interest rate achieved with the pacer's target
+        if self._pacer is not None:
+            target_interest_rate = self._pacer.get_rate() / self._get_send_cost()
+        else:
+            target_interest_rate = float('nan')
+        try:
+            achieved_interest_rate = self._interests_sent / self._elapsed_time['send_time']
+        except (KeyError, ZeroDivisionError):
+            achieved_interest_rate = float('nan')
+
         # calculate packet loss
         packet_loss = (self._num_timeouts + self._num_nacks) / self._interests_sent
 
-        # calculate average latency
-        average_latency = 'not implemented' # TODO
+        # summarize round trip times (milliseconds)
+        rtt = self._rtt.summary()
+        average_latency = rtt['mean']
 
         data = {'prefix': self._prefix,
                 'data_recieved': self._data_recieved,
@@ -198,14 +324,21 @@ class Consumer():
                 'data_goodput_kilobytes': self._data_goodput / 1000,
                 'bitrate_kbps': download_kbps,
                 'num_timeouts': self._num_timeouts,
-                'num_nacks': self._num_nacks}
+                'num_nacks': self._num_nacks,
+                'average_latency_ms': average_latency,
+                'latency_p50_ms': rtt['p50'],
+                'latency_p90_ms': rtt['p90'],
+                'latency_p99_ms': rtt['p99'],
+                'latency_max_ms': rtt['max'],
+                'target_interest_rate': target_interest_rate,
+                'achieved_interest_rate': achieved_interest_rate}
 
 
         # print info if verbositiy level 1 or higher is enabled
         if self._verbose >= 1:
             print("\n--------------------------------------------")
             print(f"{self._interests_sent} interests sent in {self._elapsed_time['send_time']:.5f} seconds.")
-            print(f"Send rate: {(self._interests_sent / self._elapsed_time['send_time']):.5f} packets per second")
+            print(f"Send rate: {achieved_interest_rate:.5f} packets per second (target {target_interest_rate:.5f})")
             print("--------------------------------------------")
             print(f"{self._data_recieved} data packets recieved")
             print(f"{self._num_nacks} nacks")
@@ -215,7 +348,7 @@ class Consumer():
             print(f"{self._elapsed_time['total_time']:.5f} seconds elapsed in total.")
             print(f"Packet loss rate: {packet_loss:.5f}")
             print(f"Latency to first byte: {time_to_first_byte_ms} ms")
-            print(f"Average latency: {average_latency} ms")
+            print(f"Average latency: {average_latency:.3f} ms (p50 {rtt['p50']:.3f}, p90 {rtt['p90']:.3f}, p99 {rtt['p99']:.3f}, max {rtt['max']:.3f})")
             print("--------------------------------------------\n")
 
         return data
@@ -231,17 +364,52 @@ class Consumer():
     def shutdown(self):
         """Shuts down this particular consumer and ends timing."""
         self._final_time['download_time'] = self._final_time['total_time'] = time.time()
-        if self._loop is not None:
+        self._finished.set()
+
+        # leave the loop running for other consumers on a shared face
+        if self._loop is not None and not self._shares_face:
             self._loop.stop()
 
 
+def setup_face(loop, ip, batch_udp=False):
+    """Sets up a face that connects to a remote forwarder, optionally batching packets per event loop tick."""
+    udp_connection_info = UdpTransport.ConnectionInfo(ip, 6363)
+    udp_transport = BatchedUdpTransport(loop) if batch_udp else UdpTransport()
+    return ThreadsafeFace(loop, udp_transport, udp_connection_info)
+
+
+def run_concurrently(ip, prefixes, num_interests, **consumer_options):
+    """Sends interests to several prefixes at once over one face and event loop.
+
+    Returns a list of dictionaries containing data for analysis, one per prefix.
+    """
+
+    loop = asyncio.get_event_loop()
+    face = setup_face(loop, ip, consumer_options.get('batch_udp', False))
+    consumers = [Consumer(ip, face=face, **consumer_options) for prefix in prefixes]
+
+    for consumer, prefix in zip(consumers, prefixes):
+        consumer.start(prefix, num_interests)
+
+    # a single task updates the shared face for every consumer
+    update_task = loop.create_task(consumers[0]._update())
+    loop.run_until_complete(asyncio.gather(*[consumer.wait_finished() for consumer in consumers]))
+    update_task.cancel()
+
+    face.shutdown()
+
+    return [consumer.status_report() for consumer in consumers]
+
+
 def rate_parser(string):
-    """Parses the rate argument."""
-    try:
-        parsed_rate = float(string)
-    except ValueError:
+    """Parses the rate argument into a (value, unit) pair.
+
+    Plain numbers are interests per second, and numbers ending in M, Mbit or Mbps are megabits of data per second.
+    """
+    match = re.fullmatch(r'([0-9]*\.?[0-9]+)\s*(m|mbit|mbps|mbit/s)?', string.strip().lower())
+    if match is None or float(match.group(1)) <= 0:
         raise argparse.ArgumentTypeError("Error in parsing rate parameter, please enter a valid one")
-    return parsed_rate
+    return float(match.group(1)), 'mbps' if match.group(2) is not None else 'interests'
 
 
 def main():
@@ -257,40 +425,56 @@ def main():
     parser.add_argument("-c", "--count", help="the number of interests to send", type=int, default=10)
     parser.add_argument("-i", "--ipaddress", help="the ip address to tunnel to", default="10.10.1.1")
     parser.add_argument("-v", "--verbosity", help="increase output verbosity", choices=[0,1,2], type=int, default=0)
-    # TODO: add rate functionality back in if needed
-    #  parser.add_argument("-r", "--rate", help="the rate at which interests are sent", type=rate_parser, default="0.00001")
+    parser.add_argument("--rate", help="pace interests to this many per second, or to this many megabits of data per second with an M suffix (e.g. 20M)", type=rate_parser)
+    parser.add_argument("--data_size", help="the expected data packet size in bytes, used to pace by megabits per second before any data arrives", type=int, default=1000)
     parser.add_argument("-r", "--repeat", help="the number of interest bursts to send", type=int, default=1)
-    parser.add_argument("-f", "--filename", help="the output file to store data to (in CSV form)")
+    parser.add_argument("-f", "--filename", help="the output file to store data to")
+    parser.add_argument("--format", help="the output file format", choices=list(OUTPUT_FORMATS), default="csv")
+    parser.add_argument("--fsync_interval", help="the number of seconds between writes of buffered output to disk", type=float, default=1.0)
+    parser.add_argument("--lifetime", help="the interest lifetime in milliseconds", type=int)
+    parser.add_argument("--max_outstanding", help="the maximum number of outstanding interests, sending blocks while this many are pending", type=int, default=65536)
+    parser.add_argument("--batch_udp", help="batch interests and data per event loop tick, with sendmmsg and recvmmsg where available", action="store_true")
+    parser.add_argument("--concurrent", help="send to all prefixes at the same time over one face", action="store_true")
 
     args = parser.parse_args()
 
+    consumer_options = {'verbose': args.verbosity,
+                        'lifetime': args.lifetime,
+                        'max_outstanding': args.max_outstanding,
+                        'rate': args.rate,
+                        'data_size': args.data_size,
+                        'batch_udp': args.batch_udp}
+
     # clean up prefix argument
     if len(args.prefix) > 1:
         args.prefix.pop(0)
 
-    # create a list of dictionaries to store data in
-    data = []
+    # store reports as they are produced, streaming them to a file if filename option is enabled
+    writer = None
+    if args.filename is not None:
+        writer = create_writer(args.filename, REPORT_COLUMNS, args.format, args.fsync_interval)
+    data = MetricsBuffer(REPORT_COLUMNS, writer=writer)
 
     # send interest burst a specified number of times
     for i in range(0, args.repeat):
 
-        # create a consumer and send interests with it for each prefix provided
-        for namespace in args.prefix:
-            consumer = Consumer(args.ipaddress, verbose=args.verbosity)
-            #  TODO: add rate functionality back in if needed
-            data.append(consumer.send_interests(namespace, args.count))
+        if args.concurrent:
+            # send to all prefixes at once so they compete for bandwidth
+            for report in run_concurrently(args.ipaddress, args.prefix, args.count, **consumer_options):
+                data.append(report)
+        else:
+            # create a consumer and send interests with it for each prefix provided
+            for namespace in args.prefix:
+                consumer = Consumer(args.ipaddress, **consumer_options)
+                data.append(consumer.send_interests(namespace, args.count))
 
 
         time.sleep(0.25)
 
-    # create dataframe from list of dictionaries
-    df = pd.DataFrame(data)
-
-    # store output to file if filename option is enabled
-    if args.filename is not None:
-        df.to_csv(args.filename)
+    # write out any remaining reports
+    data.close()
 
-    print(df)
+    data.print_rows()
 
 
 main()
@@ -1,15 +1,11 @@
 import time
 import argparse
-import traceback
-import random
 import asyncio
 from pyndn import Name
 from pyndn import Data
-from pyndn import Face
 from pyndn.security import KeyChain
-from pyndn.threadsafe_face import ThreadsafeFace
-import numpy as np
-import pandas as pd
+from signing import Signer, SIGNING_MODES
+from wire import DataTemplate, create_face
 
 
 def dump(*list):
@@ -25,22 +21,36 @@ def dump(*list):
 class Producer():
     """Hosts data under a certain namespace"""
 
-    def __init__(self, data_size, verbose=False):
+    def __init__(self, data_size, verbose=False, signing='asymmetric', hmac_key="powder-ndn"):
         # create a KeyChain for signing data packets
         self._key_chain = KeyChain()
         self._is_done = False
         self._num_interests = 0
         #  self._keyChain.createIdentityV2(Name("/ndn/identity"))
 
+        # sign data packets with the selected signature type
+        self._signer = Signer(self._key_chain, signing, hmac_key)
+
         # the number of interests to satisfy before shutdown of server
         self._max_interests = 0
 
-        # host data at the local forwarder
-        self._face = Face()
+        # establish asyncio loop
+        self._loop = asyncio.get_event_loop()
+
+        # host data at the local forwarder, handling packets as soon as its socket is readable, and
+        # keep the transport under the face for scatter-gather writes
+        self._face, self._transport = create_face(self._loop)
 
         # immutable byte array to use as data
         self._byte_array = bytes(data_size)
 
+        # encode data from a template around the one shared byte array and send it with
+        # scatter-gather writes, unless the signature type needs PyNDN to build each packet
+        if self._signer.can_sign_buffers():
+            self._template = DataTemplate(self._byte_array, self._signer)
+        else:
+            self._template = None
+
         # the number of bytes contained in each data packet
         self._data_size = data_size
 
@@ -78,11 +88,8 @@ class Producer():
         print(f"Listening for interests under {namespace}...")
         print(f"Will satisfy {max_interests} before termination.")
 
-        # Run the event loop forever. Use a short sleep to
-        # prevent the Producer from using 100% of the CPU.
-        while not self._is_done:
-            self._face.processEvents()
-            time.sleep(0.01)
+        # run the event loop until shutdown stops it
+        self._loop.run_forever()
 
         # shutdown this face - TODO: figure out why this can't be done in the self.shutdown() method
         self._face.shutdown()
@@ -94,15 +101,9 @@ class Producer():
         # keep track of when first interest was recieved
         self._initial_time['download_time'] = time.time()
 
-        # set data to a byte array of a specified size
-        interestName = interest.getName()
-        data = Data(interestName)
-        data.setContent(self._byte_array)
-
         # sign and send data
-        data.getMetaInfo().setFreshnessPeriod(3600 * 1000)
-        self._key_chain.sign(data, self._key_chain.getDefaultCertificateName())
-        transport.send(data.wireEncode().toBuffer())
+        interestName = interest.getName()
+        self._transport.send_buffers(self._encode_data(interest))
 
         # print additional information if verobse flag is set
         if self._verbose:
@@ -118,6 +119,22 @@ class Producer():
             self.shutdown()
 
 
+    def _encode_data(self, interest):
+        """Returns the signed wire encoding of a data packet answering an interest as a list of buffers."""
+
+        if self._template is not None:
+            return self._template.encode_for_interest(interest)
+
+        # set data to a byte array of a specified size
+        data = Data(interest.getName())
+        data.setContent(self._byte_array)
+
+        # sign and encode data
+        data.getMetaInfo().setFreshnessPeriod(3600 * 1000)
+        self._signer.sign(data)
+        return [bytes(data.wireEncode().toBuffer())]
+
+
     def onRegisterFailed(self, prefix):
         """Called when forwarder can't register prefix."""
         dump("Register failed for prefix", prefix.toUri())
@@ -127,6 +144,8 @@ class Producer():
     def shutdown(self):
         self._final_time['download_time'] = time.time()
         self._is_done = True
+        if self._loop is not None:
+            self._loop.stop()
         self.print_status_report()
 
 
@@ -151,6 +170,8 @@ class Producer():
         # this probably isn't a useful metric, as the output interface will throttle this
         #  print(f"{self._data_sent / 1000} kilobytes sent for a bitrate of {download_kbps} kbps")
         print(f"{self._data_size * self._interests_satisfied} bytes of data sent.")
+        print("----------------------------------")
+        self._signer.print_status_report()
         print("----------------------------------\n")
 
 
@@ -164,11 +185,13 @@ def main():
     parser.add_argument("-c", "--count", help="the number of interests to satisfy", type=int, default=10)
     parser.add_argument("-v", "--verbosity", help="increase output verbosity", action="store_true")
     parser.add_argument("-s", "--data_size", help="set the per-packet data size in bytes", type=int, default=1000)
+    parser.add_argument("--signing", help="the signature type used for data packets", choices=SIGNING_MODES, default="asymmetric")
+    parser.add_argument("--hmac_key", help="the shared key used for hmac signing", default="powder-ndn")
 
     args = parser.parse_args()
 
     # host data under a user-specified name prefix
-    producer = Producer(args.data_size, verbose=args.verbosity)
+    producer = Producer(args.data_size, verbose=args.verbosity, signing=args.signing, hmac_key=args.hmac_key)
     producer.run(args.prefix, args.count)
 
 
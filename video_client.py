@@ -0,0 +1,464 @@
+import os
+import math
+import time
+import argparse
+import asyncio
+from collections import deque
+from pyndn import Name
+from pyndn import Interest
+from pyndn.transport import UdpTransport
+from pyndn.threadsafe_face import ThreadsafeFace
+from congestion import create_window, CONGESTION_CONTROLS
+from latency import RttEstimator
+from metrics import MetricsBuffer, create_writer, OUTPUT_FORMATS
+
+
+def dump(*list):
+    """Prints all parameters"""
+
+    result = ""
+    for element in list:
+        result += (element if type(element) is str else str(element)) + " "
+    print(result)
+
+
+# the columns of each metrics row and their types
+METRIC_COLUMNS = [('timestamp', 'f8'),
+                  ('level', 'i8'),
+                  ('bitrate_kbps', 'f8'),
+                  ('estimated_throughput_kbps', 'f8'),
+                  ('measured_throughput_kbps', 'f8'),
+                  ('buffer_s', 'f8'),
+                  ('playback_position_s', 'f8'),
+                  ('startup_delay_ms', 'f8'),
+                  ('rebuffer_events', 'i8'),
+                  ('rebuffer_time_s', 'f8'),
+                  ('level_switches', 'i8'),
+                  ('chunks_fetched', 'i8'),
+                  ('segments_lost', 'i8'),
+                  ('total_num_timeouts', 'i8')]
+
+# the bitrate levels (kbps) the video is assumed to be encoded at
+DEFAULT_LEVELS = [500, 1000, 2000, 4000, 8000]
+
+
+class VideoClient():
+    """Streams a video encoded at several bitrate levels, adapting the level to throughput and buffer.
+
+    Chunk c of level l is named /prefix/l/c and fetched as segments /prefix/l/c/0, /prefix/l/c/1, ...
+    each holding data_size bytes, so any producer serving fixed-size data under the prefix
+    (such as server_stream.py) can host the video.
+    """
+
+    def __init__(self, ip, verbose=0, levels=DEFAULT_LEVELS, chunk_duration=2.0, data_size=1000,
+                 startup_buffer=2.0, max_buffer=20.0, window=16, congestion_control='aimd', max_retries=3):
+
+        self.UPDATE_TIMING = 0.001
+        # chunks are downloaded whenever the buffer has room for another
+        self.BUFFER_POLL_TIMING = 0.05
+        # the number of recent chunk throughputs averaged for the throughput estimate
+        self.THROUGHPUT_SAMPLES = 5
+
+        # establish asyncio loop
+        self._loop = asyncio.get_event_loop()
+
+        # control verbosity
+        self._verbose = verbose
+
+        # establish a local or remote face
+        self._face = setup_face(self._loop, ip)
+        self._prefix = None
+        self._time_to_run = 0
+
+        # the encoding of the video
+        self._levels = sorted(levels)
+        self._chunk_duration = chunk_duration
+        self._data_size = data_size
+
+        # playout buffer model (in seconds of video)
+        self._startup_buffer = startup_buffer
+        self._max_buffer = max_buffer
+        self._buffer = 0.0
+        self._position = 0.0
+        self._is_playing = False
+        self._last_playback_update = None
+        self._stall_start = None
+
+        # adaptation state
+        self._level = 0
+        self._throughputs = deque(maxlen=self.THROUGHPUT_SAMPLES)
+        self._num_switches = 0
+
+        # pipelined segment fetching shared by all chunks
+        self._window = create_window(congestion_control, window)
+        self._rto = RttEstimator()
+        self._max_retries = max_retries
+        self._in_flight = 0
+        self._backoff_point = 0
+        self._num_sent = 0
+
+        # the chunk being fetched: its name, segment count and progress
+        self._chunk_name = None
+        self._num_segments = 0
+        self._next_segment = 0
+        self._segments_done = 0
+        self._chunk_bytes = 0
+        self._retries = {}
+        self._chunk_done = asyncio.Event()
+
+        # keep track of some performance metrics
+        self._data = None
+        self._time = {'start': 0, 'previous': 0}
+        self._startup_delay = None
+        self._num_rebuffers = 0
+        self._rebuffer_time = 0.0
+        self._num_chunks = 0
+        self._segments_lost = 0
+        self._num_timeouts = 0
+        self._data_goodput = {'current': 0, 'previous': 0}
+
+        print(f"Consumer instance created with UDP tunnel to {ip}!")
+
+
+    def run(self, prefix, time_to_run, writer=None):
+        """Streams the video under prefix for time_to_run seconds.
+
+        Returns a MetricsBuffer containing performance information for analysis. If a
+        writer is given, rows are also streamed to it as they are produced.
+        """
+
+        print(f"Streaming video from {prefix} for {time_to_run} seconds...")
+
+        self._prefix = Name(prefix)
+        self._time_to_run = time_to_run
+        self._data = MetricsBuffer(METRIC_COLUMNS, writer=writer)
+        self._time['start'] = self._time['previous'] = self._last_playback_update = time.time()
+
+        update_task = self._loop.create_task(self._update())
+        metrics_task = self._loop.create_task(self._compute_metrics(0.5))
+        fetch_task = self._loop.create_task(self._fetch_chunks())
+
+        self._loop.run_until_complete(asyncio.sleep(time_to_run))
+
+        for task in (update_task, metrics_task, fetch_task):
+            task.cancel()
+        self._face.shutdown()
+
+        self._data.close()
+        return self._data
+
+
+    async def _fetch_chunks(self):
+        """Downloads chunks one after another, choosing the level of each, while the buffer has room."""
+
+        chunk = 0
+        while True:
+            # wait for room in the buffer
+            while self._buffer + self._chunk_duration > self._max_buffer:
+                await asyncio.sleep(self.BUFFER_POLL_TIMING)
+                self._advance_playback()
+
+            self._choose_level()
+            bitrate = self._levels[self._level]
+
+            start = time.time()
+            num_bytes = await self._fetch_chunk(self._level, chunk, bitrate)
+            elapsed = time.time() - start
+
+            if elapsed > 0:
+                self._throughputs.append(num_bytes * 8 / 1000 / elapsed)
+            self._num_chunks += 1
+            chunk += 1
+
+            self._advance_playback()
+            self._add_to_buffer()
+
+            if self._verbose >= 1:
+                dump(f"Chunk {chunk - 1} at {bitrate} kbps in {elapsed:.3f} s,", f"buffer {self._buffer:.2f} s")
+
+
+    def _estimate_throughput(self):
+        """Returns the harmonic mean of recent chunk throughputs (kbps), or 0 before any chunk."""
+        if len(self._throughputs) == 0:
+            return 0
+        return len(self._throughputs) / sum(1 / max(throughput, 1e-9) for throughput in self._throughputs)
+
+
+    def _choose_level(self):
+        """Picks the level for the next chunk from the throughput estimate and buffer occupancy.
+
+        The highest level whose bitrate fits within a safety fraction of the estimated throughput
+        is chosen. The fraction grows from 0.5 with an empty buffer to 1 with a full one, and the
+        level rises by at most one step per chunk.
+        """
+
+        estimate = self._estimate_throughput()
+        if estimate == 0:
+            return
+
+        safety = 0.5 + 0.5 * min(self._buffer / self._max_buffer, 1)
+        level = 0
+        for i, bitrate in enumerate(self._levels):
+            if bitrate <= safety * estimate:
+                level = i
+        level = min(level, self._level + 1)
+
+        if level != self._level:
+            self._num_switches += 1
+            self._level = level
+
+
+    def _advance_playback(self):
+        """Plays buffered video up to now, starting a rebuffer if the buffer runs dry."""
+
+        now = time.time()
+        if self._is_playing:
+            played = min(self._buffer, now - self._last_playback_update)
+            self._buffer -= played
+            self._position += played
+            if self._buffer <= 0:
+                self._is_playing = False
+                self._num_rebuffers += 1
+                self._stall_start = self._last_playback_update + played
+        self._last_playback_update = now
+
+
+    def _add_to_buffer(self):
+        """Adds a downloaded chunk to the buffer, starting or resuming playback once enough is buffered."""
+
+        self._buffer += self._chunk_duration
+        if self._is_playing or self._buffer < self._startup_buffer:
+            return
+
+        now = time.time()
+        self._is_playing = True
+        if self._startup_delay is None:
+            self._startup_delay = now - self._time['start']
+        if self._stall_start is not None:
+            self._rebuffer_time += now - self._stall_start
+            self._stall_start = None
+
+
+    async def _fetch_chunk(self, level, chunk, bitrate):
+        """Fetches every segment of a chunk. Returns the number of bytes recieved."""
+
+        chunk_bytes = bitrate * 1000 / 8 * self._chunk_duration
+        self._chunk_name = Name(self._prefix).append(str(level)).append(str(chunk))
+        self._num_segments = max(1, math.ceil(chunk_bytes / self._data_size))
+        self._next_segment = 0
+        self._segments_done = 0
+        self._retries = {}
+        self._chunk_bytes = 0
+
+        self._chunk_done.clear()
+        self._fill_window()
+        await self._chunk_done.wait()
+        return self._chunk_bytes
+
+
+    def _fill_window(self):
+        """Requests the chunk's next segments until the congestion window is full."""
+        while self._in_flight < int(self._window.get_window()) and self._next_segment < self._num_segments:
+            self._send(Name(self._chunk_name).append(str(self._next_segment)))
+            self._next_segment += 1
+
+
+    def _send(self, name):
+        """Sends a singular interest with the current retransmission timeout as its lifetime."""
+        interest = Interest(name)
+        interest.setMustBeFresh(False)
+        interest.setInterestLifetimeMilliseconds(self._rto.get_rto())
+        # number every interest sent so losses can be matched to the window they were sent in
+        send_time = time.time()
+        send_index = self._num_sent
+        self._face.expressInterest(interest,
+                                   lambda interest, data: self.onData(interest, data, send_time),
+                                   lambda interest: self.onTimeout(interest, send_index),
+                                   lambda interest, networkNack: self.onNetworkNack(interest, networkNack, send_index))
+        self._in_flight += 1
+        self._num_sent += 1
+
+        if self._verbose >= 2:
+            dump("Send interest with name", name.toUri())
+
+
+    def _is_current(self, interest):
+        """Returns True if an interest belongs to the chunk being fetched."""
+        return interest.getName().getPrefix(-1).equals(self._chunk_name)
+
+
+    def onData(self, interest, data, send_time):
+        """Called when a segment is recieved."""
+
+        self._in_flight -= 1
+        seq = int(interest.getName().get(-1).toEscapedString())
+
+        # measure round trip times only on first transmissions
+        if self._is_current(interest) and seq in self._retries:
+            del self._retries[seq]
+        else:
+            self._rto.add_measurement((time.time() - send_time) * 1000)
+
+        self._window.on_data()
+        self._data_goodput['current'] += len(data.getContent())
+
+        if self._is_current(interest):
+            self._chunk_bytes += len(data.getContent())
+            self._segment_done()
+        else:
+            self._fill_window()
+
+
+    def onTimeout(self, interest, send_index):
+        """Called when an interest packet times out."""
+        self._num_timeouts += 1
+        if self._verbose >= 2:
+            dump("Time out for interest", interest.getName().toUri())
+
+        # back off the retransmission timer once per round of interests
+        if send_index >= self._backoff_point:
+            self._rto.backoff()
+            self._backoff_point = self._num_sent
+        self._on_loss(interest, send_index)
+
+
+    def onNetworkNack(self, interest, networkNack, send_index):
+        """Called when an interest packet is responded to with a nack."""
+        if self._verbose >= 2:
+            dump("Network nack for interest", interest.getName().toUri())
+        self._on_loss(interest, send_index)
+
+
+    def _on_loss(self, interest, send_index):
+        """Shrinks the window and retries a lost segment, skipping it after max_retries."""
+
+        self._in_flight -= 1
+        seq = int(interest.getName().get(-1).toEscapedString())
+        self._window.on_loss(send_index, self._num_sent)
+
+        if not self._is_current(interest):
+            self._fill_window()
+            return
+
+        retries = self._retries.get(seq, 0)
+        if retries >= self._max_retries:
+            # play the chunk with this segment missing
+            self._retries.pop(seq, None)
+            self._segments_lost += 1
+            self._segment_done()
+            return
+
+        self._retries[seq] = retries + 1
+        self._send(interest.getName())
+
+
+    def _segment_done(self):
+        self._segments_done += 1
+        if self._segments_done >= self._num_segments:
+            self._chunk_done.set()
+        else:
+            self._fill_window()
+
+
+    async def _compute_metrics(self, measurement_rate):
+        """Records the state of the player every measurement_rate seconds."""
+
+        while True:
+            self._data_goodput['previous'] = self._data_goodput['current']
+            self._time['previous'] = time.time()
+
+            await asyncio.sleep(measurement_rate)
+
+            self._advance_playback()
+            now = time.time()
+
+            # include the ongoing stall in the rebuffer time
+            rebuffer_time = self._rebuffer_time
+            if self._stall_start is not None:
+                rebuffer_time += now - self._stall_start
+
+            measured_kbps = (self._data_goodput['current'] - self._data_goodput['previous']) * 8 / 1000 / (now - self._time['previous'])
+
+            self._data.append({'timestamp': now - self._time['start'],
+                               'level': self._level,
+                               'bitrate_kbps': self._levels[self._level],
+                               'estimated_throughput_kbps': self._estimate_throughput(),
+                               'measured_throughput_kbps': measured_kbps,
+                               'buffer_s': self._buffer,
+                               'playback_position_s': self._position,
+                               'startup_delay_ms': float('nan') if self._startup_delay is None else self._startup_delay * 1000,
+                               'rebuffer_events': self._num_rebuffers,
+                               'rebuffer_time_s': rebuffer_time,
+                               'level_switches': self._num_switches,
+                               'chunks_fetched': self._num_chunks,
+                               'segments_lost': self._segments_lost,
+                               'total_num_timeouts': self._num_timeouts})
+
+
+    async def _update(self):
+        """Updates events on this consumer's face."""
+        while True:
+            self._face.processEvents()
+            await asyncio.sleep(self.UPDATE_TIMING)
+
+
+
+def setup_face(loop, ip):
+    """Sets up a face that connects to a remote forwarder."""
+    udp_connection_info = UdpTransport.ConnectionInfo(ip, 6363)
+    udp_transport = UdpTransport()
+    return ThreadsafeFace(loop, udp_transport, udp_connection_info)
+
+
+def levels_parser(string):
+    """Parses a comma-separated list of bitrate levels."""
+    try:
+        levels = [float(level) for level in string.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Error in parsing levels, please enter comma-separated bitrates in kbps")
+    return levels
+
+
+def main():
+    """Streams a video with the specified properties."""
+
+    # silence the warning from interest wire encode
+    Interest.setDefaultCanBePrefix(True)
+
+    # handle and specify arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-p", "--prefix", help="the prefix the video is published under", default="/ndn/external/video")
+    parser.add_argument("-t", "--time", help="the number of seconds to stream for", type=int, default=60)
+    parser.add_argument("-i", "--ipaddress", help="the ip address to tunnel to", default="10.10.1.1")
+    parser.add_argument("-v", "--verbosity", help="increase output verbosity", choices=[0, 1, 2], type=int, default=0)
+    parser.add_argument("-l", "--levels", help="comma-separated bitrate levels of the video in kbps", type=levels_parser, default=DEFAULT_LEVELS)
+    parser.add_argument("--chunk_duration", help="the number of seconds of video in each chunk", type=float, default=2.0)
+    parser.add_argument("-s", "--data_size", help="the per-packet data size of the producer in bytes", type=int, default=1000)
+    parser.add_argument("--startup_buffer", help="the number of seconds of video buffered before playback starts or resumes", type=float, default=2.0)
+    parser.add_argument("--max_buffer", help="the maximum number of seconds of video to buffer", type=float, default=20.0)
+    parser.add_argument("-w", "--window", help="the initial congestion window size for fetching segments", type=int, default=16)
+    parser.add_argument("--cc", help="the congestion control algorithm", choices=CONGESTION_CONTROLS, default="aimd")
+    parser.add_argument("--max_retries", help="the maximum number of retransmissions per segment before skipping it", type=int, default=3)
+    parser.add_argument("-f", "--filename", help="the output file to store data to")
+    parser.add_argument("--format", help="the output file format", choices=list(OUTPUT_FORMATS), default="csv")
+    parser.add_argument("--fsync_interval", help="the number of seconds between writes of buffered output to disk", type=float, default=1.0)
+
+    args = parser.parse_args()
+
+    writer = None
+    if args.filename is not None:
+        # lead with video- so that analysis.py doesn't mistake the playback metrics for a stream result file
+        directory, base = os.path.split(args.filename)
+        filename = os.path.join(directory, 'video-' + base + args.prefix.replace('/', '-'))
+        writer = create_writer(filename, METRIC_COLUMNS, args.format, args.fsync_interval)
+
+    client = VideoClient(args.ipaddress, verbose=args.verbosity, levels=args.levels, chunk_duration=args.chunk_duration,
+                         data_size=args.data_size, startup_buffer=args.startup_buffer, max_buffer=args.max_buffer,
+                         window=args.window, congestion_control=args.cc, max_retries=args.max_retries)
+    metrics = client.run(args.prefix, args.time, writer)
+
+    metrics.print_rows(['timestamp', 'bitrate_kbps', 'estimated_throughput_kbps', 'buffer_s', 'startup_delay_ms', 'rebuffer_events', 'rebuffer_time_s'])
+
+
+main()
@@ -0,0 +1,233 @@
+"""
+Template encoding of data packets around a shared payload buffer, and scatter-gather sending, for the producers
+
+"""
+import os
+from pyndn import Face
+from pyndn.encoding import TlvWireFormat
+from pyndn.threadsafe_face import ThreadsafeFace
+from pyndn.transport.async_tcp_transport import AsyncTcpTransport
+from pyndn.transport.async_unix_transport import AsyncUnixTransport
+
+
+# TLV types from the NDN packet format
+TLV_DATA = 0x06
+TLV_META_INFO = 0x14
+TLV_CONTENT = 0x15
+TLV_SIGNATURE_VALUE = 0x17
+TLV_FRESHNESS_PERIOD = 0x19
+
+
+def encode_var_number(value):
+    """Returns the variable-length encoding of a TLV type or length."""
+    if value < 253:
+        return bytes([value])
+    if value <= 0xffff:
+        return b'\xfd' + value.to_bytes(2, 'big')
+    if value <= 0xffffffff:
+        return b'\xfe' + value.to_bytes(4, 'big')
+    return b'\xff' + value.to_bytes(8, 'big')
+
+
+def encode_non_negative_integer(value):
+    """Returns the shortest 1, 2, 4 or 8 byte encoding of a non-negative integer."""
+    for size in (1, 2, 4, 8):
+        if value < 1 << (8 * size):
+            return value.to_bytes(size, 'big')
+    raise ValueError(f"Integer too large to encode: {value}")
+
+
+def encode_tlv_header(tlv_type, length):
+    """Returns the type and length of a TLV element."""
+    return encode_var_number(tlv_type) + encode_var_number(length)
+
+
+def encode_tlv(tlv_type, value):
+    """Returns a whole TLV element with the given value."""
+    return encode_tlv_header(tlv_type, len(value)) + value
+
+
+
+class DataTemplate():
+    """Encodes data packets that differ only in their name, without copying the shared payload.
+
+    MetaInfo, the Content header and SignatureInfo are encoded once; each packet splices in the
+    name TLV and signs the spliced buffers in place. encode returns a list of buffers (header,
+    shared payload, trailer) whose concatenation is the packet's wire encoding. Only signers that
+    can sign buffers (digest and HMAC) are supported.
+    """
+
+    def __init__(self, payload, signer, freshness_period=3600 * 1000):
+        if not signer.can_sign_buffers():
+            raise ValueError(f"Cannot encode data from a template with {signer.get_mode()} signing")
+
+        self._payload = memoryview(payload)
+        self._signer = signer
+        self._wire_format = TlvWireFormat.get()
+
+        # everything between the name and the payload, and the signature info after it
+        meta_info = encode_tlv(TLV_META_INFO, encode_tlv(TLV_FRESHNESS_PERIOD, encode_non_negative_integer(freshness_period)))
+        self._after_name = meta_info + encode_tlv_header(TLV_CONTENT, len(self._payload))
+        self._signature_info = signer.get_signature_info()
+        self._signature_header = encode_tlv_header(TLV_SIGNATURE_VALUE, signer.get_signature_size())
+
+        # the length of every packet apart from its name TLV
+        self._fixed_length = (len(self._after_name) + len(self._payload) + len(self._signature_info)
+                              + len(self._signature_header) + signer.get_signature_size())
+
+
+    def encode(self, name):
+        """Returns the signed wire encoding of a data packet with the given name as a list of buffers."""
+        return self.encode_name_tlv(self._wire_format.encodeName(name).toBytes())
+
+
+    def encode_for_interest(self, interest):
+        """Returns the signed wire encoding of a data packet named after an interest as a list of buffers.
+
+        The name TLV is copied straight out of the interest's wire encoding rather than re-encoded.
+        """
+        if interest.getApplicationParameters().size() != 0:
+            return self.encode(interest.getName())
+        return self.encode_name_tlv(get_name_tlv(interest.wireEncode().buf()))
+
+
+    def encode_name_tlv(self, name_tlv):
+        """Returns the signed wire encoding of a data packet with an already encoded name as a list of buffers."""
+
+        head = name_tlv + self._after_name
+        signature = self._signer.sign_buffers([head, self._payload, self._signature_info])
+
+        header = encode_tlv_header(TLV_DATA, len(name_tlv) + self._fixed_length) + head
+        return [header, self._payload, self._signature_info + self._signature_header + signature]
+
+
+
+def decode_var_number(buffer, offset):
+    """Returns a TLV type or length decoded at offset, and the offset just after it."""
+    first = buffer[offset]
+    if first < 253:
+        return first, offset + 1
+    size = 1 << (first - 252)
+    return int.from_bytes(buffer[offset + 1:offset + 1 + size], 'big'), offset + 1 + size
+
+
+def get_name_tlv(interest_encoding):
+    """Returns the bytes of the name TLV (the first element) of an encoded interest."""
+    _, offset = decode_var_number(interest_encoding, 0)
+    _, offset = decode_var_number(interest_encoding, offset)
+    start = offset
+    _, offset = decode_var_number(interest_encoding, offset)
+    length, offset = decode_var_number(interest_encoding, offset)
+    return bytes(interest_encoding[start:offset + length])
+
+
+
+class _GatheringSocketTransport():
+    """Adds sending of packets given as lists of buffers to PyNDN's asyncio socket transports.
+
+    Each packet is written to the socket with one writev call. Packets go through the asyncio
+    transport instead whenever it already has data queued, so that packets are never reordered,
+    and joined into one buffer and sent normally if the writev path isn't available, which is
+    reported once.
+    """
+
+    def __init__(self, loop):
+        super().__init__(loop)
+
+        # the asyncio transport and socket written to, found once the connection is made
+        self._socket_transport = None
+        self._socket = None
+
+        # keep track of how many packets took the scatter-gather path
+        self._num_gathered = 0
+        self._num_joined = 0
+
+
+    def connect(self, connectionInfo, elementListener, onConnected):
+        """Connects to the forwarder, looking up the socket to write packets to once connected."""
+
+        def on_connected():
+            self._find_socket()
+            if onConnected is not None:
+                onConnected()
+
+        super().connect(connectionInfo, elementListener, on_connected)
+
+
+    def _find_socket(self):
+        """Looks up the asyncio transport PyNDN connected, reporting if writev can't be used with it."""
+
+        # AsyncSocketTransport keeps the asyncio transport in a private attribute
+        transport = getattr(self, '_transport', None)
+        socket = transport.get_extra_info('socket') if transport is not None else None
+        if socket is None or not hasattr(os, 'writev'):
+            print("Scatter-gather writes are unavailable, sending data packets as joined buffers instead.")
+            return
+
+        self._socket_transport = transport
+        self._socket = socket
+
+
+    def send_buffers(self, buffers):
+        """Sends the concatenation of buffers as one packet."""
+
+        transport = self._socket_transport
+        if self._socket is None or transport.get_write_buffer_size() > 0:
+            self._num_joined += 1
+            self.send(b''.join(buffers))
+            return
+
+        try:
+            sent = os.writev(self._socket.fileno(), buffers)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            # let the transport report the error the same way it would for any other write
+            transport.write(b''.join(buffers))
+            return
+
+        # queue whatever the socket didn't take behind the part that was sent
+        if sent < sum(len(buffer) for buffer in buffers):
+            transport.write(b''.join(buffers)[sent:])
+        self._num_gathered += 1
+
+
+    def close(self):
+        self._socket_transport = None
+        self._socket = None
+        super().close()
+
+
+    def get_num_gathered(self):
+        return self._num_gathered
+
+
+    def get_num_joined(self):
+        return self._num_joined
+
+
+
+class GatheringUnixTransport(_GatheringSocketTransport, AsyncUnixTransport):
+    """AsyncUnixTransport that can send packets given as lists of buffers."""
+
+
+
+class GatheringTcpTransport(_GatheringSocketTransport, AsyncTcpTransport):
+    """AsyncTcpTransport that can send packets given as lists of buffers."""
+
+
+
+def create_face(loop):
+    """Returns a face to the local forwarder and the gathering transport it uses.
+
+    The forwarder is reached the same way ThreadsafeFace(loop) would: over its Unix socket if
+    that exists, and over TCP to localhost otherwise.
+    """
+    file_path = Face._getUnixSocketFilePathForLocalhost()
+    if file_path == "":
+        transport = GatheringTcpTransport(loop)
+        connection_info = AsyncTcpTransport.ConnectionInfo("localhost", 6363)
+    else:
+        transport = GatheringUnixTransport(loop)
+        connection_info = AsyncUnixTransport.ConnectionInfo(file_path)
+    return ThreadsafeFace(loop, transport, connection_info), transport